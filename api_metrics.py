@@ -0,0 +1,126 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from flask import Response, g, request
+from flask.json.provider import DefaultJSONProvider
+from opensearchpy import Transport
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+from sqlalchemy import event
+
+# Metricas de recommendations_api.py en formato Prometheus (GET /metrics). Con gunicorn se usa el modo multiproceso
+# de prometheus_client (PROMETHEUS_MULTIPROC_DIR, ver gunicorn.conf.py) para que /metrics sume todos los workers
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# En que se va el tiempo de cada request
+COMPONENTS = ('postgres', 'opensearch', 'serialization')
+
+REQUESTS = Counter('api_requests_total', 'HTTP requests by route, method and status',
+                   ['route', 'method', 'status'])
+REQUEST_LATENCY = Histogram('api_request_duration_seconds', 'HTTP request latency by route and method',
+                            ['route', 'method'], buckets=LATENCY_BUCKETS)
+REQUEST_COMPONENT_LATENCY = Histogram('api_request_component_duration_seconds',
+                                      'Time spent per request in postgres, opensearch and serialization',
+                                      ['route', 'component'], buckets=LATENCY_BUCKETS)
+IN_FLIGHT = Gauge('api_requests_in_flight', 'HTTP requests currently being served', ['route'],
+                  multiprocess_mode='livesum')
+
+# Tiempo acumulado por componente de la request que atiende cada thread (None fuera de una request)
+_timings = threading.local()
+
+
+def add_time(component, seconds):
+    timings = getattr(_timings, 'current', None)
+    if timings is not None:
+        timings[component] += seconds
+
+
+@contextmanager
+def timed(component):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_time(component, time.perf_counter() - start)
+
+
+def instrument_engine(engine):
+    """
+    Suma a la request en curso el tiempo de cada query ejecutada por engine
+    """
+    @event.listens_for(engine, 'before_cursor_execute')
+    def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info['metrics_query_start'] = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+        add_time('postgres', time.perf_counter() - conn.info.pop('metrics_query_start'))
+
+
+class TimedTransport(Transport):
+    """
+    Transport de OpenSearch que suma a la request en curso el tiempo de cada llamada al cluster
+    (get_movie_vector, get_k_similar_movies). Se usa con OpenSearch(..., transport_class=TimedTransport)
+    """
+
+    def perform_request(self, *args, **kwargs):
+        with timed('opensearch'):
+            return super().perform_request(*args, **kwargs)
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """
+    Mide la serializacion de jsonify y de las listas o dicts devueltos por las rutas
+    """
+
+    def response(self, *args, **kwargs):
+        with timed('serialization'):
+            return super().response(*args, **kwargs)
+
+
+def route_label():
+    # El patron de la ruta y no el path, para no abrir una serie por movie_id o user_id
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+def metrics():
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
+
+
+def init_metrics(app):
+    """
+    Registra los hooks que miden cada request y la ruta GET /metrics.
+    En las respuestas streameadas (NDJSON) la latencia llega hasta el primer byte, no hasta el final del stream
+    """
+    app.json = TimedJSONProvider(app)
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_route = route_label()
+        g.metrics_start = time.perf_counter()
+        _timings.current = dict.fromkeys(COMPONENTS, 0.0)
+        IN_FLIGHT.labels(g.metrics_route).inc()
+
+    @app.after_request
+    def record_request_metrics(response):
+        route = g.get('metrics_route')
+        if route is not None:
+            REQUESTS.labels(route, request.method, str(response.status_code)).inc()
+            REQUEST_LATENCY.labels(route, request.method).observe(time.perf_counter() - g.metrics_start)
+            for component, seconds in _timings.current.items():
+                REQUEST_COMPONENT_LATENCY.labels(route, component).observe(seconds)
+        return response
+
+    @app.teardown_request
+    def finish_request_metrics(exception=None):
+        route = g.pop('metrics_route', None)
+        if route is not None:
+            IN_FLIGHT.labels(route).dec()
+        _timings.current = None
+
+    app.add_url_rule('/metrics', 'metrics', metrics)
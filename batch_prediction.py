@@ -0,0 +1,229 @@
+import argparse
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import joblib
+import numpy as np
+import pandas as pd
+from pelicula import Pelicula
+from candidate_generation import get_embedding_tables, top_candidates, recall_at_k
+from numpy_rating_model import NumpyRatingModel
+from notebook_ids import NotebookIds
+
+# Estado de cada proceso worker, inicializado una sola vez por init_worker
+worker_state = {}
+
+
+class CatalogInputs:
+    """
+    Arrays de entrada del modelo, en el espacio de ids de la notebook (dict_users / dict_pelis):
+    # movie_ids y genres: una fila por pelicula del catalogo, con su vector de 19 generos
+    # seen_user_ids / seen_movie_positions: pares ya rankeados, ordenados por usuario, con la posicion de la pelicula en movie_ids
+    """
+
+    def __init__(self, movie_ids, genres, seen_user_ids, seen_movie_positions):
+        self.movie_ids = movie_ids
+        self.genres = genres
+        self.seen_user_ids = seen_user_ids
+        self.seen_movie_positions = seen_movie_positions
+
+    @classmethod
+    def load(cls, movies_file='peliculas_df', scores_file='score_peli_df'):
+        df_movies = joblib.load(movies_file)
+        movie_ids = df_movies['movie_id'].values.astype(np.int64)
+        genres = df_movies[Pelicula.generos_de_peliculas].values.astype(np.float32)
+
+        df_scores = joblib.load(scores_file)
+        position_by_movie_id = np.full(movie_ids.max() + 1, -1, dtype=np.int64)
+        position_by_movie_id[movie_ids] = np.arange(len(movie_ids))
+        seen_user_ids = df_scores['user_id'].values.astype(np.int64)
+        seen_movie_positions = position_by_movie_id[df_scores['movie_id'].values.astype(np.int64)]
+        order = np.argsort(seen_user_ids, kind='stable')
+        return cls(movie_ids, genres, seen_user_ids[order], seen_movie_positions[order])
+
+    def user_ids(self):
+        return np.unique(self.seen_user_ids)
+
+    def unseen_mask(self, user_ids):
+        """
+        Devuelve user_ids ordenados y la mascara usuarios x peliculas de los pares aun no vistos
+        """
+        user_ids = np.sort(np.asarray(user_ids, dtype=np.int64))
+        unseen = np.ones((len(user_ids), len(self.movie_ids)), dtype=bool)
+        lo = np.searchsorted(self.seen_user_ids, user_ids, side='left')
+        hi = np.searchsorted(self.seen_user_ids, user_ids, side='right')
+        counts = hi - lo
+        rows = np.repeat(np.arange(len(user_ids)), counts)
+        # Indices de los scores de cada usuario del chunk: lo[u], lo[u]+1, ..., hi[u]-1
+        seen = np.arange(counts.sum()) + np.repeat(lo - (np.cumsum(counts) - counts), counts)
+        cols = self.seen_movie_positions[seen]
+        valid = cols >= 0
+        unseen[rows[valid], cols[valid]] = False
+        return user_ids, unseen
+
+    def build_unseen_inputs(self, user_ids):
+        """
+        Arma las entradas (user_id, movie_id, generos) de todos los pares no vistos de user_ids, con operaciones
+        vectorizadas sobre una mascara usuarios x peliculas del chunk
+        """
+        user_ids, unseen = self.unseen_mask(user_ids)
+        user_positions, movie_positions = np.nonzero(unseen)
+        return user_ids[user_positions], self.movie_ids[movie_positions], self.genres[movie_positions]
+
+    def build_candidate_inputs(self, user_ids, embedding_tables, n_candidates):
+        """
+        Igual que build_unseen_inputs pero solo con las n_candidates peliculas no vistas de cada usuario con mayor
+        producto interno entre los embeddings embuser/embmovie del modelo (primera etapa del retrieval)
+        """
+        user_ids, unseen = self.unseen_mask(user_ids)
+        user_embeddings, movie_embeddings = embedding_tables
+        user_positions, movie_positions = top_candidates(user_embeddings[user_ids], movie_embeddings[self.movie_ids],
+                                                         unseen, n_candidates)
+        return user_ids[user_positions], self.movie_ids[movie_positions], self.genres[movie_positions]
+
+
+def load_model(model_file, threads):
+    # Los pesos exportados a .npz se predicen en NumPy, sin importar TensorFlow
+    if model_file.endswith('.npz'):
+        return NumpyRatingModel.load(model_file)
+    # TensorFlow se importa solo en los workers, el proceso principal no lo necesita
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(threads)
+    return tf.keras.models.load_model(model_file, compile=False)
+
+
+def init_worker(model_file, catalog_inputs, batch_size, threads, n_candidates):
+    worker_state["model"] = load_model(model_file, threads)
+    worker_state["catalog_inputs"] = catalog_inputs
+    worker_state["batch_size"] = batch_size
+    worker_state["n_candidates"] = n_candidates
+    worker_state["embedding_tables"] = get_embedding_tables(worker_state["model"]) if n_candidates else None
+
+
+def predict_inputs(model, users, movies, genres, batch_size):
+    if len(users) == 0:
+        return pd.DataFrame({'movie_id': movies, 'user_id': users, 'ratings_pred': np.empty(0, dtype=np.float32)})
+    ratings_pred = model.predict([users, movies, genres], batch_size=batch_size, verbose=0)
+    return pd.DataFrame({'movie_id': movies, 'user_id': users, 'ratings_pred': np.ravel(ratings_pred)})
+
+
+def score_users(user_ids):
+    """
+    Predice el rating de las peliculas no vistas de user_ids: todas, o solo las candidatas de la primera etapa
+    si se configuró n_candidates. Corre dentro de un worker
+    """
+    catalog_inputs = worker_state["catalog_inputs"]
+    if worker_state["n_candidates"]:
+        users, movies, genres = catalog_inputs.build_candidate_inputs(user_ids, worker_state["embedding_tables"],
+                                                                      worker_state["n_candidates"])
+    else:
+        users, movies, genres = catalog_inputs.build_unseen_inputs(user_ids)
+    return predict_inputs(worker_state["model"], users, movies, genres, worker_state["batch_size"])
+
+
+def top_k_by_user(predictions, k):
+    predictions = predictions.sort_values(['user_id', 'ratings_pred'], ascending=[True, False])
+    return {user_id: list(group['movie_id'].head(k)) for user_id, group in predictions.groupby('user_id')}
+
+
+def measure_recall(model, catalog_inputs, user_ids, n_candidates, k=10, batch_size=8192):
+    """
+    Compara el top-k del retrieval en dos etapas contra el top-k exhaustivo (todas las peliculas no vistas)
+    para user_ids. Devuelve el recall@k promedio
+    """
+    exhaustive = predict_inputs(model, *catalog_inputs.build_unseen_inputs(user_ids), batch_size)
+    two_stage = predict_inputs(model, *catalog_inputs.build_candidate_inputs(user_ids, get_embedding_tables(model), n_candidates),
+                               batch_size)
+    return recall_at_k(top_k_by_user(exhaustive, k), top_k_by_user(two_stage, k))
+
+
+def predict_all(model_file, catalog_inputs, user_ids, users_per_chunk=64, batch_size=8192, workers=None, threads_per_worker=1,
+                n_candidates=None):
+    """
+    Genera las predicciones de todos los user_ids por chunks de usuarios en un pool de procesos.
+    Con n_candidates solo se predicen las peliculas candidatas de la primera etapa del retrieval.
+    Es un generador de DataFrames (movie_id, user_id, ratings_pred) en el orden de los chunks; como mucho
+    hay 2 chunks por worker en vuelo, asi la memoria no depende de la cantidad de usuarios
+    """
+    workers = workers or os.cpu_count()
+    chunks = (user_ids[start:start + users_per_chunk] for start in range(0, len(user_ids), users_per_chunk))
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(model_file, catalog_inputs, batch_size, threads_per_worker, n_candidates)) as executor:
+        in_flight = deque()
+        for chunk in chunks:
+            in_flight.append(executor.submit(score_users, chunk))
+            if len(in_flight) >= 2 * workers:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+def report_progress(chunks, total_users):
+    """
+    Reenvia los chunks reportando usuarios procesados, predicciones y throughput
+    """
+    start_time = time.perf_counter()
+    users, rows = 0, 0
+    for chunk in chunks:
+        users += chunk['user_id'].nunique()
+        rows += len(chunk)
+        elapsed = time.perf_counter() - start_time
+        print(f"{users}/{total_users} usuarios, {rows:,} predicciones en {elapsed:.1f}s ({rows / max(elapsed, 1e-9):,.0f} predicciones/s)")
+        yield chunk
+
+
+def write_csv(chunks, filename):
+    for i, chunk in enumerate(chunks):
+        chunk.to_csv(filename, mode='w' if i == 0 else 'a', header=i == 0, index=False)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Predice el rating de todas las peliculas no vistas de todos los usuarios")
+    parser.add_argument('--model', default='model.h5',
+                        help="modelo entrenado en model_creation.ipynb, o sus pesos exportados a .npz para predecir sin TensorFlow")
+    parser.add_argument('--movies', default='peliculas_df', help="artefacto joblib con movie_id y generos")
+    parser.add_argument('--scores', default='score_peli_df', help="artefacto joblib con los scores (ids de la notebook)")
+    parser.add_argument('--users-per-chunk', type=int, default=64)
+    parser.add_argument('--batch-size', type=int, default=8192, help="batch size de predict")
+    parser.add_argument('--workers', type=int, default=None, help="procesos (default: cantidad de CPUs)")
+    parser.add_argument('--threads-per-worker', type=int, default=1)
+    parser.add_argument('--output', default='predictions.csv',
+                        help="csv de salida, con ids de la notebook (lo lee db_predictions_persistance.py)")
+    parser.add_argument('--to-postgres', action='store_true', help="persistir directo en una nueva version de Prediction_Score en vez de a csv")
+    parser.add_argument('--candidates', type=int, default=None,
+                        help="predecir solo las N peliculas candidatas por usuario (producto interno de embeddings) en vez de todas")
+    parser.add_argument('--recall-users', type=int, default=100,
+                        help="con --candidates, usuarios sobre los que medir el recall@k contra el camino exhaustivo (0 = no medir)")
+    parser.add_argument('--recall-k', type=int, default=10)
+    parser.add_argument('--partitions', type=int, default=0,
+                        help="con --to-postgres, particiones por hash de user_id de Prediction_Score (0 = sin particionar)")
+    parser.add_argument('--users-map', default='dict_users',
+                        help="con --to-postgres, artefacto joblib de la notebook: user_id de la DB -> de la notebook")
+    parser.add_argument('--movies-map', default='dict_pelis',
+                        help="con --to-postgres, artefacto joblib de la notebook: movie_id de la DB -> de la notebook")
+    args = parser.parse_args()
+
+    catalog_inputs = CatalogInputs.load(args.movies, args.scores)
+    user_ids = catalog_inputs.user_ids()
+    if args.candidates and args.recall_users:
+        print("------------------------------")
+        print(f"MIDIENDO RECALL@{args.recall_k} CON {args.candidates} CANDIDATAS")
+        sample = np.random.default_rng(0).choice(user_ids, size=min(args.recall_users, len(user_ids)), replace=False)
+        recall = measure_recall(load_model(args.model, args.threads_per_worker), catalog_inputs, sample,
+                                args.candidates, args.recall_k, args.batch_size)
+        print(f"Recall@{args.recall_k} sobre {len(sample)} usuarios: {recall:.4f}")
+
+    print("------------------------------")
+    print(f"PREDICIENDO {len(user_ids)} USUARIOS x {args.candidates or len(catalog_inputs.movie_ids)} PELICULAS")
+    chunks = predict_all(args.model, catalog_inputs, user_ids, args.users_per_chunk, args.batch_size,
+                         args.workers, args.threads_per_worker, args.candidates)
+    if args.to_postgres:
+        # Carga una nueva version de Prediction_Score y la activa al terminar; ya reporta progreso y throughput.
+        # Prediction_Score usa los ids de la DB
+        from db_predictions_persistance import engine, publish_predictions
+        notebook_ids = NotebookIds.load(args.users_map, args.movies_map)
+        publish_predictions(engine, (notebook_ids.predictions_to_db(chunk) for chunk in chunks), partitions=args.partitions)
+    else:
+        write_csv(report_progress(chunks, len(user_ids)), args.output)
@@ -0,0 +1,29 @@
+import io
+import time
+
+
+def to_pg_array(values):
+    """
+    Transforma una lista de strings al literal de array de Postgres, ej: ['Action', "Children's"] -> {"Action","Children's"}
+    """
+    escaped = ['"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"' for value in values]
+    return '{' + ','.join(escaped) + '}'
+
+
+def copy_dataframe(cursor, df, table_name, columns, chunk_size=100000, verbose=True):
+    """
+    Carga df en table_name con COPY FROM STDIN (formato csv), de a chunk_size filas para acotar la memoria del buffer.
+    columns son las columnas de la tabla, en el mismo orden que las columnas de df. Devuelve la cantidad de filas cargadas
+    """
+    column_list = ", ".join(f'"{column}"' for column in columns)
+    statement = f'COPY "{table_name}" ({column_list}) FROM STDIN WITH (FORMAT csv)'
+    start_time = time.perf_counter()
+    for start in range(0, len(df), chunk_size):
+        buffer = io.StringIO()
+        df.iloc[start:start + chunk_size].to_csv(buffer, header=False, index=False)
+        buffer.seek(0)
+        cursor.copy_expert(statement, buffer)
+    elapsed = time.perf_counter() - start_time
+    if verbose:
+        print(f"{len(df)} filas copiadas a {table_name} en {elapsed:.2f}s ({len(df) / max(elapsed, 1e-9):,.0f} filas/s)")
+    return len(df)
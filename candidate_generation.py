@@ -0,0 +1,40 @@
+import numpy as np
+from numpy_rating_model import NumpyRatingModel
+
+
+def get_embedding_tables(model):
+    """
+    Devuelve las tablas de embeddings aprendidas (embuser, embmovie) del modelo de model_creation.ipynb,
+    indexadas por los ids de la notebook
+    """
+    if isinstance(model, NumpyRatingModel):
+        return model.embuser, model.embmovie
+    return model.get_layer('embuser').get_weights()[0], model.get_layer('embmovie').get_weights()[0]
+
+
+def top_candidates(user_embeddings, movie_embeddings, unseen, n_candidates):
+    """
+    Primera etapa del retrieval: para cada usuario (fila de user_embeddings) elige las n_candidates peliculas
+    no vistas con mayor producto interno entre embeddings, con un unico producto matricial por chunk de usuarios.
+    unseen es la mascara usuarios x peliculas de pares no vistos. Devuelve (user_positions, movie_positions)
+    de los pares candidatos
+    """
+    scores = user_embeddings @ movie_embeddings.T
+    scores[~unseen] = -np.inf
+    n_candidates = min(n_candidates, scores.shape[1])
+    top = np.argpartition(-scores, n_candidates - 1, axis=1)[:, :n_candidates]
+    # Si un usuario tiene menos de n_candidates peliculas sin ver, descarto las ya vistas que quedaron en el top
+    user_positions = np.repeat(np.arange(scores.shape[0]), n_candidates)
+    movie_positions = top.ravel()
+    valid = unseen[user_positions, movie_positions]
+    return user_positions[valid], movie_positions[valid]
+
+
+def recall_at_k(exhaustive_top, two_stage_top):
+    """
+    Recall promedio del top-k del retrieval en dos etapas contra el top-k exhaustivo.
+    Ambos son dicts user_id -> lista de movie_ids
+    """
+    recalls = [len(set(two_stage_top.get(user_id, [])) & set(movies)) / len(movies)
+               for user_id, movies in exhaustive_top.items() if movies]
+    return float(np.mean(recalls)) if recalls else 0.0
@@ -0,0 +1,26 @@
+from sqlalchemy import select
+from pelicula import Pelicula
+
+
+class Catalog:
+    """
+    Catalogo de peliculas de solo lectura en memoria: movie_id -> json (mismo formato que Pelicula.get_by_ids).
+    La API lo carga una sola vez al iniciar; con gunicorn y preload_app se carga en el master antes del fork y
+    los workers lo comparten copy-on-write en vez de releer Pelicula de Postgres en cada request
+    """
+
+    def __init__(self, peliculas):
+        self.peliculas = peliculas
+
+    @classmethod
+    def load(cls, session):
+        return cls({row.id: Pelicula.create_dict_from_row(row) for row in session.execute(select(Pelicula)).scalars()})
+
+    def get_by_ids(self, movie_ids):
+        """
+        Respeta el orden de movie_ids y omite los ids que no existan. Devuelve copias, que el caller puede modificar
+        """
+        return [dict(self.peliculas[int(movie_id)]) for movie_id in movie_ids if int(movie_id) in self.peliculas]
+
+    def __len__(self):
+        return len(self.peliculas)
@@ -0,0 +1,61 @@
+import argparse
+import pandas as pd
+from sqlalchemy import select, func
+from sqlalchemy.orm import sessionmaker
+from score import Score
+from dirty_user import DirtyUser, Base as Dirty_UserBase
+from user_fold_in import UserFoldIn
+from db_predictions_persistance import engine, upsert_predictions
+
+
+def iter_refreshed_predictions(session, fold_in, user_ids, users_per_chunk, refreshed_user_ids):
+    """
+    Recalcula las predicciones de user_ids (ids de la DB) por chunks de usuarios: una query de scores por chunk,
+    fold-in de cada usuario y prediccion de sus peliculas no vistas. Es un generador de DataFrames
+    (movie_id, user_id, ratings_pred) con ids de la DB.
+    Agrega a refreshed_user_ids los usuarios de cada chunk recien cuando el consumidor pide el siguiente, es decir
+    cuando upsert_predictions ya commiteo sus predicciones
+    """
+    for start in range(0, len(user_ids), users_per_chunk):
+        chunk = user_ids[start:start + users_per_chunk]
+        ratings_by_user = Score.get_ratings_by_user_ids(session, chunk)
+        predictions = [fold_in.predict_user(user_id, ratings_by_user.get(user_id, [])) for user_id in chunk]
+        yield pd.concat(predictions, ignore_index=True)
+        refreshed_user_ids.extend(chunk)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Recalcula solo las predicciones de los usuarios con scores nuevos (Dirty_User)")
+    parser.add_argument('--model', default='model_weights.npz', help="pesos exportados con numpy_rating_model.py")
+    parser.add_argument('--movies', default='peliculas_df', help="artefacto joblib con movie_id y generos")
+    parser.add_argument('--users-map', default='dict_users', help="artefacto joblib de la notebook: user_id de la DB -> de la notebook")
+    parser.add_argument('--movies-map', default='dict_pelis', help="artefacto joblib de la notebook: movie_id de la DB -> de la notebook")
+    parser.add_argument('--users-per-chunk', type=int, default=256, help="usuarios por query de scores (y por transaccion)")
+    parser.add_argument('--steps', type=int, default=100, help="pasos de gradiente del fold-in")
+    args = parser.parse_args()
+
+    Dirty_UserBase.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    # Los usuarios que cambien durante la corrida quedan marcados para la siguiente
+    changed_before = session.execute(select(func.clock_timestamp())).scalar()
+    user_ids = DirtyUser.get_user_ids(session, changed_before)
+    session.commit()
+
+    print("------------------------------")
+    print(f"RECALCULANDO PREDICCIONES DE {len(user_ids)} USUARIOS")
+    if user_ids:
+        fold_in = UserFoldIn.load(args.model, args.movies, args.users_map, args.movies_map, steps=args.steps)
+        connection = engine.raw_connection()
+        refreshed_user_ids = []
+        try:
+            upsert_predictions(connection, iter_refreshed_predictions(session, fold_in, user_ids, args.users_per_chunk,
+                                                                      refreshed_user_ids))
+        finally:
+            connection.close()
+            # Solo se desmarcan los usuarios con predicciones ya persistidas: si la corrida falla a mitad de camino,
+            # el resto queda marcado para la siguiente
+            session.rollback()
+            DirtyUser.clear(session, refreshed_user_ids, changed_before)
+            session.commit()
+            print(f"{len(refreshed_user_ids)}/{len(user_ids)} USUARIOS RECALCULADOS")
+    session.close()
@@ -1,11 +1,14 @@
-from opensearchpy import OpenSearch
+from opensearchpy import OpenSearch, helpers
 from opensearchpy import Field, Boolean, Float, Integer, Document, Keyword, Text, DenseVector, Nested, Date, Object
 import datetime
 import joblib
 import warnings
 import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 
 
+# La API consulta siempre el alias; los datos viven en indices versionados movie_v<N>
 index_name = 'movie'
 
 # Disable all warnings
@@ -47,7 +50,109 @@ class Movie(Document):
         return super(Movie, self).save(** kwargs)
 
 
+def movie_actions(df_movies, array_embeddings, index):
+    """
+    Genera las acciones del bulk API: un documento Movie por fila de peliculas_df, con el embedding de la misma fila
+    """
+    created_at = datetime.datetime.now()
+    for i, (_, row) in enumerate(df_movies.iterrows()):
+        yield {
+            "_index": index,
+            "_id": str(row['movie_id']),
+            "_source": {
+                "movie_id": row['movie_id'],
+                "url": row["IMDB URL"],
+                "name": row['Name'],
+                "vector": [float(value) for value in array_embeddings[i]],
+                "created_at": created_at
+            }
+        }
+
+
+def chunks(actions, chunk_size):
+    chunk = []
+    for action in actions:
+        chunk.append(action)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def index_chunk(client, chunk_number, chunk):
+    """
+    Indexa un chunk con el bulk API y reporta los documentos que fallaron. Devuelve (ok, errores)
+    """
+    success, errors = helpers.bulk(client, chunk, chunk_size=len(chunk), raise_on_error=False, raise_on_exception=False)
+    for error in errors:
+        operation = next(iter(error.values()))
+        print(f"ERROR EN CHUNK {chunk_number}, movie_id {operation.get('_id')}: {operation.get('error')}")
+    return success, len(errors)
+
+
+def bulk_index(client, index, actions, chunk_size=500, workers=1):
+    """
+    Carga las acciones por chunks con el bulk API, opcionalmente en paralelo, con el refresh del indice
+    deshabilitado durante la carga. Devuelve la cantidad de documentos indexados y con error
+    """
+    settings = client.indices.get_settings(index=index)
+    refresh_interval = next(iter(settings.values()))["settings"]["index"].get("refresh_interval")
+    client.indices.put_settings(index=index, body={"index": {"refresh_interval": "-1"}})
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(lambda numbered_chunk: index_chunk(client, *numbered_chunk),
+                                        enumerate(chunks(actions, chunk_size))))
+    finally:
+        # None vuelve al refresh_interval por default del cluster
+        client.indices.put_settings(index=index, body={"index": {"refresh_interval": refresh_interval}})
+        client.indices.refresh(index=index)
+    return sum(success for success, _ in results), sum(errors for _, errors in results)
+
+
+def get_index_versions(client):
+    """
+    Devuelve los numeros de version de los indices movie_v<N> existentes, ordenados
+    """
+    indices = client.indices.get(index=f"{index_name}_v*")
+    return sorted(int(index[len(f"{index_name}_v"):]) for index in indices if index[len(f"{index_name}_v"):].isdigit())
+
+
+def swap_alias(client, new_index):
+    """
+    Mueve el alias movie al nuevo indice en una sola operacion atomica. Si movie todavia es un indice concreto
+    (carga previa sin versionar) se elimina en la misma operacion
+    """
+    actions = []
+    if client.indices.exists_alias(name=index_name):
+        for index in client.indices.get_alias(name=index_name):
+            actions.append({"remove": {"index": index, "alias": index_name}})
+    elif client.indices.exists(index=index_name):
+        actions.append({"remove_index": {"index": index_name}})
+    actions.append({"add": {"index": new_index, "alias": index_name}})
+    client.indices.update_aliases(body={"actions": actions})
+
+
+def delete_old_versions(client, retention):
+    """
+    Borra los indices versionados mas viejos, conservando los ultimos retention y nunca el apuntado por el alias
+    """
+    aliased = set(client.indices.get_alias(name=index_name)) if client.indices.exists_alias(name=index_name) else set()
+    versions = get_index_versions(client)
+    for version in versions[:max(len(versions) - retention, 0)]:
+        old_index = f"{index_name}_v{version}"
+        if old_index not in aliased:
+            print(f"ELIMINANDO INDICE {old_index}")
+            client.indices.delete(index=old_index)
+
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Indexa los embeddings de peliculas en OpenSearch con el bulk API")
+    parser.add_argument('--chunk-size', type=int, default=500, help="documentos por request de bulk")
+    parser.add_argument('--workers', type=int, default=1, help="requests de bulk en paralelo")
+    parser.add_argument('--retention', type=int, default=2, help="indices versionados a conservar (incluido el activo)")
+    args = parser.parse_args()
+
     print("------------------------------")
     print("VALIDANDO CONEXIÓN CON OPENSEARCH")
 
@@ -64,12 +169,10 @@ if __name__ == '__main__':
     # %%
     print(client.cluster.health())
 
-    print(f"EXISTE INDICE MOVIE: {client.indices.exists('movie')}")
-    if client.indices.exists('movie'):
-        print("ELIMINANDO INDICE MOVIE")
-        client.indices.delete('movie')
-
-    Movie.init(using=client)
+    versions = get_index_versions(client)
+    new_index = f"{index_name}_v{versions[-1] + 1 if versions else 1}"
+    print(f"CREANDO INDICE {new_index} (el alias {index_name} sigue apuntando a la version anterior)")
+    Movie.init(index=new_index, using=client)
 
     print("------------------------------")
     print("PERSISTIENDO EMBEDDINGS MOVIES EN OPENSEARCH")
@@ -77,19 +180,17 @@ if __name__ == '__main__':
     df_movies = joblib.load('peliculas_df')
     array_embeddings = joblib.load('embedding_movies_genre')
 
-    #print(array_embeddings[265])
-    #print(array_embeddings[266])
-    """"""
-    # Iterate over DataFrame and ndarray elements
-    for i, row in df_movies.iterrows():
-            try:
-                mv = Movie(
-                    movie_id=row['movie_id'],
-                    url=row["IMDB URL"],
-                    name=row['Name'],
-                    vector=list(array_embeddings[i]),
-                    created_at=datetime.datetime.now()
-                )
-                mv.save(using=client)
-            except:
-                print(f"ERROR WITH {i}")
+    indexed, failed = bulk_index(client, new_index, movie_actions(df_movies, array_embeddings, new_index),
+                                 chunk_size=args.chunk_size, workers=args.workers)
+    print(f"Se indexaron {indexed} peliculas, {failed} con error")
+
+    print("------------------------------")
+    print("VALIDANDO Y ACTIVANDO INDICE")
+    count = client.count(index=new_index)["count"]
+    if count != len(df_movies):
+        print(f"ERROR: {new_index} tiene {count} documentos y se esperaban {len(df_movies)}. Se descarta y el alias no cambia")
+        client.indices.delete(index=new_index)
+        raise SystemExit(1)
+    swap_alias(client, new_index)
+    print(f"ALIAS {index_name} -> {new_index}")
+    delete_old_versions(client, args.retention)
@@ -0,0 +1,99 @@
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy import Column, Integer, DateTime, func, text, any_
+from sqlalchemy.dialects.postgresql import insert
+
+Base = declarative_base()
+
+# Triggers por sentencia sobre Score: un solo upsert en Dirty_User por INSERT/UPDATE/DELETE (o COPY), con los
+# user_id distintos de las filas afectadas (transition tables). Tambien notifica esos usuarios a la API (canal
+# recommendations_changed de recommendations_notifications.py, de a 500 por mensaje) para que invalide su cache
+SCORE_TRIGGERS_DDL = [
+    '''
+    CREATE OR REPLACE FUNCTION mark_dirty_users() RETURNS trigger AS $$
+    DECLARE
+        payload text;
+    BEGIN
+        INSERT INTO "Dirty_User" (user_id, changed_at)
+        SELECT user_id, clock_timestamp() FROM (SELECT DISTINCT user_id FROM changed_scores) AS changed_users
+        ON CONFLICT (user_id) DO UPDATE SET changed_at = EXCLUDED.changed_at;
+        FOR payload IN
+            SELECT json_build_object('sender', 'score_trigger', 'user_ids', json_agg(user_id ORDER BY user_id))::text
+            FROM (SELECT user_id, (row_number() OVER (ORDER BY user_id) - 1) / 500 AS grupo
+                  FROM (SELECT DISTINCT user_id FROM changed_scores) AS changed_users) AS numbered
+            GROUP BY grupo
+        LOOP
+            PERFORM pg_notify('recommendations_changed', payload);
+        END LOOP;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    ''',
+    'DROP TRIGGER IF EXISTS score_dirty_users_insert ON "Score"',
+    'DROP TRIGGER IF EXISTS score_dirty_users_update ON "Score"',
+    'DROP TRIGGER IF EXISTS score_dirty_users_delete ON "Score"',
+    '''
+    CREATE TRIGGER score_dirty_users_insert AFTER INSERT ON "Score"
+    REFERENCING NEW TABLE AS changed_scores FOR EACH STATEMENT EXECUTE FUNCTION mark_dirty_users()
+    ''',
+    '''
+    CREATE TRIGGER score_dirty_users_update AFTER UPDATE ON "Score"
+    REFERENCING NEW TABLE AS changed_scores FOR EACH STATEMENT EXECUTE FUNCTION mark_dirty_users()
+    ''',
+    '''
+    CREATE TRIGGER score_dirty_users_delete AFTER DELETE ON "Score"
+    REFERENCING OLD TABLE AS changed_scores FOR EACH STATEMENT EXECUTE FUNCTION mark_dirty_users()
+    ''',
+]
+
+
+class DirtyUser(Base):
+    """
+    Usuarios cuyos scores cambiaron desde la ultima corrida de predicciones. Se llena desde Score.write_df /
+    remove_from_df y con triggers sobre la tabla Score; lo consume db_predictions_refresh.py
+    """
+    __tablename__ = 'Dirty_User'
+
+    user_id = Column(Integer, primary_key=True, autoincrement=False)
+    changed_at = Column(DateTime(timezone=True), nullable=False, server_default=func.clock_timestamp())
+
+    def __init__(self, user_id, changed_at=None):
+        self.user_id = user_id
+        self.changed_at = changed_at
+
+    @classmethod
+    def create_triggers(cls, connection):
+        """
+        Crea (o recrea) los triggers de Score que marcan a los usuarios en Dirty_User
+        """
+        for statement in SCORE_TRIGGERS_DDL:
+            connection.execute(text(statement))
+
+    @classmethod
+    def mark(cls, session, user_ids):
+        """
+        Marca a los usuarios como pendientes de recalcular; si ya estaban marcados se actualiza changed_at.
+        No commitea: queda en la misma transaccion que el cambio de scores
+        """
+        statement = insert(DirtyUser).values([{'user_id': int(user_id)} for user_id in set(user_ids)])
+        statement = statement.on_conflict_do_update(index_elements=['user_id'], set_={'changed_at': func.clock_timestamp()})
+        session.execute(statement)
+
+    @classmethod
+    def get_user_ids(cls, session, changed_before):
+        rows = (session
+                .query(DirtyUser.user_id)
+                .filter(DirtyUser.changed_at <= changed_before)
+                .order_by(DirtyUser.user_id)
+                .all())
+        return [row.user_id for row in rows]
+
+    @classmethod
+    def clear(cls, session, user_ids, changed_before):
+        """
+        Desmarca a los usuarios ya recalculados. Los que volvieron a cambiar despues de changed_before siguen marcados
+        """
+        (session
+         .query(DirtyUser)
+         .filter(DirtyUser.user_id == any_([int(user_id) for user_id in user_ids]))
+         .filter(DirtyUser.changed_at <= changed_before)
+         .delete(synchronize_session=False))
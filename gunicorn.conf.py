@@ -0,0 +1,55 @@
+import gc
+import multiprocessing
+import os
+import shutil
+
+# Entrypoint de produccion de recommendations_api.py: gunicorn -c gunicorn.conf.py recommendations_api:app
+# Con preload_app el master importa la app y when_ready corre warm_up (catalogo, vectores, recomendaciones en memoria)
+# una sola vez antes del fork; los workers comparten esa memoria copy-on-write
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:90")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+preload_app = True
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 60))
+accesslog = "-"
+
+# Un worker atiende a lo sumo `threads` requests a la vez: su pool no necesita mas conexiones que esas, mas una de
+# overflow para el fold-in (session + conexion raw) o el warm-up en background. Con la conexion LISTEN de cada worker
+# la API abre como mucho workers * (threads + 2) conexiones, que tiene que entrar en el max_connections de Postgres
+# (100 por defecto).
+# Tiene que estar definido antes de importar la app
+os.environ.setdefault("API_POOL_SIZE", str(threads))
+os.environ.setdefault("API_POOL_MAX_OVERFLOW", "1")
+
+# GET /metrics suma las metricas de todos los workers (modo multiproceso de prometheus_client): cada worker escribe
+# en este directorio, que se vacia al arrancar. Tiene que estar definido antes de importar la app
+prometheus_multiproc_dir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/prometheus_multiproc")
+shutil.rmtree(prometheus_multiproc_dir, ignore_errors=True)
+os.makedirs(prometheus_multiproc_dir)
+
+
+def when_ready(server):
+    from recommendations_api import warm_up
+    try:
+        warm_up()
+    except Exception as e:
+        # Postgres u OpenSearch caidos: los workers arrancan igual, reintentan el warm-up cada uno por su cuenta
+        # y /ready responde 503 hasta que terminen
+        server.log.warning(f"Warm-up fallido en el master, se reintenta en cada worker: {e}")
+    # Mueve los objetos del warm-up a la generacion permanente: el GC de los workers no los recorre y no ensucia
+    # (ni copia) las paginas compartidas con el master
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    from recommendations_api import reset_connections_after_fork, warm_up_in_background, warmed_up, recommendations_listener
+    reset_connections_after_fork()
+    # Cada worker tiene su propia cache y snapshot: escucha los cambios hechos por los demas y por los procesos batch
+    recommendations_listener.start()
+    if not warmed_up.is_set():
+        warm_up_in_background()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,167 @@
+import threading
+import joblib
+import numpy as np
+from sqlalchemy import any_
+from score import Score
+from prediction_score import PredictionScore
+from catalog import Catalog
+
+
+class RecommendationsSnapshot:
+    """
+    Estructuras de lectura de las recomendaciones en memoria, con ids de la DB (los de Prediction_Score y Score):
+    # movies_by_user: user_id -> array de movie_ids ordenado descendentemente por ratings_pred
+    # seen_by_user: user_id -> bitset (np.packbits) de las peliculas que el usuario ya rankeó
+    # catalog: movie_id -> json de la pelicula (mismo formato que Pelicula.get_by_ids)
+    # n_bits: bits de cada bitset de seen_by_user (cubre todos los movie_ids de las predicciones)
+    Puede leerse sin locks: solo cambia via replace_users, que reemplaza las entradas de cada usuario
+    """
+
+    def __init__(self, movies_by_user, seen_by_user, catalog, n_bits):
+        self.movies_by_user = movies_by_user
+        self.seen_by_user = seen_by_user
+        self.catalog = catalog
+        self.n_bits = n_bits
+
+    @classmethod
+    def build(cls, pred_user_ids, pred_movie_ids, ratings_pred, seen_user_ids, seen_movie_ids, catalog, min_bits=0):
+        pred_user_ids = np.asarray(pred_user_ids, dtype=np.int64)
+        pred_movie_ids = np.asarray(pred_movie_ids, dtype=np.int64)
+        ratings_pred = np.asarray(ratings_pred, dtype=np.float64)
+        seen_user_ids = np.asarray(seen_user_ids, dtype=np.int64)
+        seen_movie_ids = np.asarray(seen_movie_ids, dtype=np.int64)
+
+        # Ordeno por user_id y, dentro de cada usuario, por prediccion descendente
+        order = np.lexsort((-ratings_pred, pred_user_ids))
+        pred_user_ids, pred_movie_ids = pred_user_ids[order], pred_movie_ids[order]
+        users, starts = np.unique(pred_user_ids, return_index=True)
+        movies_by_user = {int(user_id): movie_ids.astype(np.int32)
+                          for user_id, movie_ids in zip(users, np.split(pred_movie_ids, starts[1:]))}
+
+        # Un bitset por usuario con un bit por movie_id (~1.7k peliculas -> ~210 bytes por usuario)
+        n_bits = max(int(max(pred_movie_ids.max(initial=0), seen_movie_ids.max(initial=0))) + 1, min_bits)
+        order = np.argsort(seen_user_ids, kind='stable')
+        seen_user_ids, seen_movie_ids = seen_user_ids[order], seen_movie_ids[order]
+        users, starts = np.unique(seen_user_ids, return_index=True)
+        seen_by_user = {}
+        for user_id, movie_ids in zip(users, np.split(seen_movie_ids, starts[1:])):
+            seen = np.zeros(n_bits, dtype=bool)
+            seen[movie_ids] = True
+            seen_by_user[int(user_id)] = np.packbits(seen)
+
+        return cls(movies_by_user, seen_by_user, catalog, n_bits)
+
+    def replace_users(self, user_ids, pred_user_ids, pred_movie_ids, ratings_pred, seen_user_ids, seen_movie_ids):
+        """
+        Reemplaza las predicciones y los scores de user_ids por los recibidos. Cada entrada se cambia con una sola
+        asignacion, por lo que las requests concurrentes leen la version anterior o la nueva de cada estructura, y
+        los bitsets nuevos cubren al menos n_bits para seguir siendo compatibles con las predicciones anteriores
+        """
+        updated = RecommendationsSnapshot.build(pred_user_ids, pred_movie_ids, ratings_pred, seen_user_ids,
+                                                seen_movie_ids, self.catalog, min_bits=self.n_bits)
+        for user_id in (int(user_id) for user_id in user_ids):
+            # Primero el bitset: nunca queda un bitset mas chico que las predicciones que se leen con el
+            if user_id in updated.seen_by_user:
+                self.seen_by_user[user_id] = updated.seen_by_user[user_id]
+            if user_id in updated.movies_by_user:
+                self.movies_by_user[user_id] = updated.movies_by_user[user_id]
+            else:
+                self.movies_by_user.pop(user_id, None)
+            if user_id not in updated.seen_by_user:
+                self.seen_by_user.pop(user_id, None)
+
+    def recommend(self, user_id, k):
+        movie_ids = self.movies_by_user.get(int(user_id))
+        if movie_ids is None:
+            return []
+        seen = self.seen_by_user.get(int(user_id))
+        if seen is not None:
+            # Chequeo vectorizado del bit de cada pelicula candidata en el bitset del usuario
+            ya_vista = seen[movie_ids >> 3] & (128 >> (movie_ids & 7))
+            movie_ids = movie_ids[ya_vista == 0]
+
+        recommendations = []
+        for movie_id in movie_ids:
+            pelicula = self.catalog.get(int(movie_id))
+            if pelicula is not None:
+                recommendations.append(dict(pelicula, ranking=len(recommendations) + 1))
+                if len(recommendations) == k:
+                    break
+        return recommendations
+
+
+class InMemoryRecommendations:
+    """
+    Motor de recomendaciones sin SQL en el camino caliente: carga las predicciones, los scores y el catalogo de
+    peliculas en memoria al iniciar, y cada request es un scan en memoria de las predicciones del usuario.
+    reload_* reconstruye todas las estructuras y las reemplaza atomicamente, por lo que las requests en curso
+    siguen leyendo el snapshot anterior hasta terminar
+    """
+
+    def __init__(self, catalog=None):
+        self.snapshot = None
+        # Catalogo de solo lectura compartido con la API (el de warm_up); sin catalogo se carga una sola vez en el
+        # primer reload y los siguientes lo reutilizan
+        self.catalog = catalog
+        self._reload_lock = threading.Lock()
+
+    def load_catalog(self, session):
+        if self.catalog is None:
+            self.catalog = Catalog.load(session)
+        return self.catalog.peliculas
+
+    @classmethod
+    def load_seen(cls, session):
+        rows = session.query(Score.user_id, Score.pelicula_id).all()
+        return [row.user_id for row in rows], [row.pelicula_id for row in rows]
+
+    def reload_from_db(self, session):
+        """
+        Reconstruye el motor a partir de la tabla Prediction_Score
+        """
+        with self._reload_lock:
+            rows = session.query(PredictionScore.user_id, PredictionScore.movie_id, PredictionScore.ratings_pred).all()
+            seen_user_ids, seen_movie_ids = self.load_seen(session)
+            self.snapshot = RecommendationsSnapshot.build([row.user_id for row in rows],
+                                                          [row.movie_id for row in rows],
+                                                          [row.ratings_pred for row in rows],
+                                                          seen_user_ids, seen_movie_ids,
+                                                          self.load_catalog(session))
+
+    def reload_from_artifact(self, session, notebook_ids, filename='all_predictions'):
+        """
+        Reconstruye el motor a partir del dataframe de predicciones exportado con joblib por la notebook, traduciendo
+        sus ids con notebook_ids a los de la DB para que coincidan con los de Score y con refresh_users
+        """
+        with self._reload_lock:
+            df_predictions = notebook_ids.predictions_to_db(joblib.load(filename)[['movie_id', 'user_id', 'ratings_pred']])
+            seen_user_ids, seen_movie_ids = self.load_seen(session)
+            self.snapshot = RecommendationsSnapshot.build(df_predictions['user_id'].values,
+                                                          df_predictions['movie_id'].values,
+                                                          df_predictions['ratings_pred'].values,
+                                                          seen_user_ids, seen_movie_ids,
+                                                          self.load_catalog(session))
+
+    def refresh_users(self, session, user_ids):
+        """
+        Vuelve a leer de Prediction_Score y Score solo las filas de user_ids (ids de la DB, p.ej. despues de un
+        fold-in) y las reemplaza en el snapshot actual, sin reconstruir todo el motor
+        """
+        user_ids = [int(user_id) for user_id in user_ids]
+        with self._reload_lock:
+            if self.snapshot is None:
+                return
+            rows = (session
+                    .query(PredictionScore.user_id, PredictionScore.movie_id, PredictionScore.ratings_pred)
+                    .filter(PredictionScore.user_id == any_(user_ids))
+                    .all())
+            seen_rows = session.query(Score.user_id, Score.pelicula_id).filter(Score.user_id == any_(user_ids)).all()
+            self.snapshot.replace_users(user_ids,
+                                        [row.user_id for row in rows],
+                                        [row.movie_id for row in rows],
+                                        [row.ratings_pred for row in rows],
+                                        [row.user_id for row in seen_rows],
+                                        [row.pelicula_id for row in seen_rows])
+
+    def recommend(self, user_id, k):
+        return self.snapshot.recommend(user_id, k)
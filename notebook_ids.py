@@ -0,0 +1,49 @@
+import joblib
+
+
+class NotebookIds:
+    """
+    Traduce entre los ids de la DB (Score, Pelicula, Prediction_Score y la API) y los ids de la notebook con los que se
+    entrenó el modelo (dict_users / dict_pelis, exportados con joblib por model_creation.ipynb). Los embeddings del
+    modelo y los artefactos de la notebook (peliculas_df, score_peli_df, all_predictions, el csv de batch_prediction.py)
+    están en el espacio de la notebook
+    """
+
+    def __init__(self, dict_users, dict_pelis):
+        self.dict_users = {int(db_id): int(notebook_id) for db_id, notebook_id in dict_users.items()}
+        self.dict_pelis = {int(db_id): int(notebook_id) for db_id, notebook_id in dict_pelis.items()}
+        self.db_users = {notebook_id: db_id for db_id, notebook_id in self.dict_users.items()}
+        self.db_pelis = {notebook_id: db_id for db_id, notebook_id in self.dict_pelis.items()}
+
+    @classmethod
+    def load(cls, users_file='dict_users', movies_file='dict_pelis'):
+        return cls(joblib.load(users_file), joblib.load(movies_file))
+
+    def user_id(self, db_user_id):
+        """
+        Id de la notebook del usuario, o None si el usuario no estaba en el entrenamiento
+        """
+        return self.dict_users.get(int(db_user_id))
+
+    def ratings(self, db_ratings):
+        """
+        Traduce una lista de tuplas (pelicula_id, puntuacion) a ids de la notebook, omitiendo las peliculas que no
+        estaban en el entrenamiento
+        """
+        return [(self.dict_pelis[int(movie_id)], puntuacion) for movie_id, puntuacion in db_ratings
+                if int(movie_id) in self.dict_pelis]
+
+    def db_movie_ids(self, movie_ids):
+        """
+        Inversa de movie_ids: ids de la DB de peliculas de la notebook, en el mismo orden
+        """
+        return [self.db_pelis[int(movie_id)] for movie_id in movie_ids]
+
+    def predictions_to_db(self, df_predictions):
+        """
+        Traduce user_id y movie_id de un DataFrame de predicciones de la notebook a ids de la DB, para escribirlo en
+        Prediction_Score. Descarta las filas con ids que no estan en dict_users / dict_pelis
+        """
+        df_predictions = df_predictions.assign(user_id=df_predictions['user_id'].map(self.db_users),
+                                               movie_id=df_predictions['movie_id'].map(self.db_pelis))
+        return df_predictions.dropna(subset=['user_id', 'movie_id']).astype({'user_id': 'int64', 'movie_id': 'int64'})
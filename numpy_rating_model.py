@@ -0,0 +1,113 @@
+import argparse
+import numpy as np
+
+# Capas densas del modelo de model_creation.ipynb, en orden. La salida es (5 - 1) * sigmoid(...) (capa Lambda)
+DENSE_LAYERS = ['conextion', 'conextion1', 'conextion2', 'conextion3']
+OUTPUT_SCALE = 5 - 1
+
+
+def export_weights(model, filename='model_weights.npz'):
+    """
+    Exporta los pesos del modelo Keras a un .npz: tablas de embeddings y kernel/bias de cada capa densa
+    """
+    weights = {
+        'embuser': model.get_layer('embuser').get_weights()[0],
+        'embmovie': model.get_layer('embmovie').get_weights()[0],
+    }
+    for name in DENSE_LAYERS:
+        weights[f'{name}_kernel'], weights[f'{name}_bias'] = model.get_layer(name).get_weights()
+    np.savez_compressed(filename, **{name: value.astype(np.float32) for name, value in weights.items()})
+
+
+def sigmoid(x):
+    # Equivalente a 1 / (1 + exp(-x)) sin overflow para x muy negativos
+    return 0.5 * (1 + np.tanh(0.5 * x))
+
+
+class NumpyRatingModel:
+    """
+    Forward pass del modelo de rating en NumPy puro, para predecir sin TensorFlow.
+    La primera capa densa recibe concat(embmovie[movie], embuser[user], generos), por lo que su kernel se parte en
+    tres bloques y los bloques de embeddings se proyectan una unica vez por tabla: cada prediccion pasa a ser una
+    suma de filas precalculadas mas el aporte de los generos
+    """
+
+    def __init__(self, embuser, embmovie, kernels, biases):
+        self.embuser = embuser
+        self.embmovie = embmovie
+        self.kernels = kernels
+        self.biases = biases
+        movie_dim, user_dim = embmovie.shape[1], embuser.shape[1]
+        first_kernel = kernels[0]
+        self.user_kernel = first_kernel[movie_dim:movie_dim + user_dim]
+        self.genre_kernel = first_kernel[movie_dim + user_dim:]
+        self.movie_projection = embmovie @ first_kernel[:movie_dim]
+        self.user_projection = embuser @ self.user_kernel
+
+    @classmethod
+    def load(cls, filename='model_weights.npz'):
+        weights = np.load(filename)
+        return cls(weights['embuser'], weights['embmovie'],
+                   [weights[f'{name}_kernel'] for name in DENSE_LAYERS],
+                   [weights[f'{name}_bias'] for name in DENSE_LAYERS])
+
+    def forward(self, user_projection, movie_ids, genres):
+        """
+        Forward pass a partir de la proyeccion del usuario en la primera capa (una fila por ejemplo)
+        """
+        hidden = sigmoid(user_projection + self.movie_projection[movie_ids] + genres @ self.genre_kernel + self.biases[0])
+        for kernel, bias in zip(self.kernels[1:], self.biases[1:]):
+            hidden = sigmoid(hidden @ kernel + bias)
+        return OUTPUT_SCALE * hidden
+
+    def predict(self, inputs, batch_size=65536, verbose=0):
+        """
+        Misma interfaz que model.predict([user_ids, movie_ids, generos]) de Keras: devuelve un array (n, 1)
+        """
+        user_ids, movie_ids, genres = (np.asarray(values) for values in inputs)
+        user_ids, movie_ids = user_ids.reshape(-1).astype(np.int64), movie_ids.reshape(-1).astype(np.int64)
+        genres = genres.astype(np.float32)
+        ratings_pred = np.empty((len(user_ids), 1), dtype=np.float32)
+        for start in range(0, len(user_ids), batch_size):
+            end = start + batch_size
+            ratings_pred[start:end] = self.forward(self.user_projection[user_ids[start:end]], movie_ids[start:end], genres[start:end])
+        return ratings_pred
+
+    def predict_with_user_vector(self, user_vector, movie_ids, genres):
+        """
+        Predice para un embedding de usuario arbitrario (por ejemplo uno que no está en embuser)
+        """
+        user_projection = np.asarray(user_vector, dtype=np.float32) @ self.user_kernel
+        return self.forward(user_projection[np.newaxis, :], np.asarray(movie_ids, dtype=np.int64),
+                            np.asarray(genres, dtype=np.float32)).ravel()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Exporta los pesos del modelo Keras a .npz y valida el forward pass en NumPy")
+    parser.add_argument('--model', default='model.h5')
+    parser.add_argument('--output', default='model_weights.npz')
+    parser.add_argument('--movies', default='peliculas_df', help="artefacto joblib con movie_id y generos, para validar")
+    parser.add_argument('--verify-samples', type=int, default=10000)
+    parser.add_argument('--tolerance', type=float, default=1e-4)
+    args = parser.parse_args()
+
+    import joblib
+    import tensorflow as tf
+    from pelicula import Pelicula
+
+    keras_model = tf.keras.models.load_model(args.model, compile=False)
+    export_weights(keras_model, args.output)
+    numpy_model = NumpyRatingModel.load(args.output)
+    print(f"Pesos exportados a {args.output}")
+
+    df_movies = joblib.load(args.movies)
+    rng = np.random.default_rng(0)
+    rows = rng.integers(0, len(df_movies), args.verify_samples)
+    user_ids = rng.integers(1, numpy_model.embuser.shape[0], args.verify_samples)
+    movie_ids = df_movies['movie_id'].values[rows]
+    genres = df_movies[Pelicula.generos_de_peliculas].values[rows].astype(np.float32)
+    expected = keras_model.predict([user_ids, movie_ids, genres], batch_size=8192, verbose=0)
+    max_error = float(np.max(np.abs(numpy_model.predict([user_ids, movie_ids, genres]) - expected)))
+    print(f"Error absoluto maximo contra Keras sobre {args.verify_samples} ejemplos: {max_error:.2e}")
+    if max_error > args.tolerance:
+        raise SystemExit(f"ERROR: el error supera la tolerancia {args.tolerance}")
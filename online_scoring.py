@@ -0,0 +1,146 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import joblib
+import numpy as np
+from pelicula import Pelicula
+from numpy_rating_model import NumpyRatingModel
+from notebook_ids import NotebookIds
+
+
+def missing_files(*filenames):
+    return [filename for filename in filenames if not os.path.exists(filename)]
+
+
+class MicroBatcher:
+    """
+    Agrupa requests concurrentes en micro-batches: un thread consume la cola y llama a process_batch con hasta
+    max_batch_size items, esperando como mucho max_wait_ms desde que llega el primer item del batch.
+    process_batch recibe la lista de items y devuelve la lista de resultados en el mismo orden.
+    submit devuelve un Future con el resultado del item.
+    El thread se arranca en el primer submit de cada proceso: los threads no sobreviven al fork de los workers de gunicorn
+    """
+
+    def __init__(self, process_batch, max_batch_size=64, max_wait_ms=5):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self._pid = None
+
+    def _start(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def submit(self, item):
+        if self._pid != os.getpid():
+            self._start()
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            items = [item for item, _ in batch]
+            try:
+                results = self.process_batch(items)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+            with self._lock:
+                self.batches += 1
+                self.items += len(items)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "items": self.items,
+                "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait_ms,
+            }
+
+
+class OnlineScorer:
+    """
+    Scoring en vivo de todo el catalogo con NumpyRatingModel, para usuarios sin predicciones en Prediction_Score
+    (altas posteriores al ultimo batch) o con predicciones desactualizadas.
+    Recibe y devuelve ids de la DB, como Prediction_Score, Score y Pelicula: notebook_ids (dict_users / dict_pelis) los
+    traduce a los del modelo. Los usuarios que no estaban en el entrenamiento usan el embedding de usuario promedio
+    """
+
+    def __init__(self, model, movie_ids, genres, notebook_ids):
+        self.model = model
+        self.movie_ids = movie_ids
+        self.genres = genres
+        self.notebook_ids = notebook_ids
+        # Id de la DB de cada pelicula de movie_ids
+        self.db_movie_ids = np.asarray(notebook_ids.db_movie_ids(movie_ids), dtype=np.int64)
+        # La fila 0 de embuser no corresponde a ningun usuario (los ids de la notebook empiezan en 1)
+        self.mean_user_projection = model.user_projection[1:].mean(axis=0)
+
+    @classmethod
+    def load(cls, model_file='model_weights.npz', movies_file='peliculas_df', users_map_file='dict_users',
+             movies_map_file='dict_pelis'):
+        df_movies = joblib.load(movies_file)
+        return cls(NumpyRatingModel.load(model_file),
+                   df_movies['movie_id'].values.astype(np.int64),
+                   df_movies[Pelicula.generos_de_peliculas].values.astype(np.float32),
+                   NotebookIds.load(users_map_file, movies_map_file))
+
+    def user_projection(self, db_user_id):
+        user_id = self.notebook_ids.user_id(db_user_id)
+        if user_id is not None and 0 < user_id < len(self.model.user_projection):
+            return self.model.user_projection[user_id]
+        return self.mean_user_projection
+
+    def score_batch(self, requests):
+        """
+        requests es una lista de tuplas (user_id, pelicula_ids ya vistos, k) con ids de la DB. Arma las entradas de las
+        peliculas no vistas de todos los usuarios del batch y hace un unico forward pass. Devuelve, por request, la
+        lista de los ids de la DB de las k peliculas con mayor prediccion
+        """
+        unseen = [np.flatnonzero(~np.isin(self.db_movie_ids, np.asarray(seen_movie_ids, dtype=np.int64)))
+                  for _, seen_movie_ids, _ in requests]
+        counts = [len(positions) for positions in unseen]
+        projections = np.stack([self.user_projection(user_id) for user_id, _, _ in requests])
+        positions = np.concatenate(unseen)
+        ratings_pred = self.model.forward(np.repeat(projections, counts, axis=0), self.movie_ids[positions],
+                                          self.genres[positions]).ravel()
+
+        top_movies = []
+        for (_, _, k), user_positions, user_ratings in zip(requests, unseen, np.split(ratings_pred, np.cumsum(counts)[:-1])):
+            n = min(k, len(user_positions))
+            if n == 0:
+                top_movies.append([])
+                continue
+            top = np.argpartition(-user_ratings, n - 1)[:n]
+            top = top[np.argsort(-user_ratings[top], kind='stable')]
+            top_movies.append([int(movie_id) for movie_id in self.db_movie_ids[user_positions[top]]])
+        return top_movies
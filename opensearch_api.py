@@ -1,7 +1,12 @@
-def get_movie_vector(client, movie_id):
+from opensearchpy import helpers
+
+# Alias que apunta al indice versionado activo (ver db_vectorial_embeddings_saving.py)
+INDEX_ALIAS = 'movie'
+
+def movie_vector_query(movie_id):
 
     # Buscar movie en opensearch
-    query = {
+    return {
         "query": {
             "term": {
                 "movie_id": {
@@ -10,15 +15,13 @@ def get_movie_vector(client, movie_id):
             }
         }
     }
-    response = client.search(index='movie', body=query)
-    if response['hits']['hits']:
-        return response['hits']['hits'][0]["_source"]["vector"]
-    return None
 
 
-def get_k_similar_movies(client, movie_vector, k):
-    query = {
+def k_similar_movies_query(movie_vector, k):
+    return {
         "size": k,
+        # Solo traigo el movie_id de los vecinos, no sus vectores
+        "_source": ["movie_id"],
         "query": {
             "knn": {
                 "vector": {
@@ -28,5 +31,51 @@ def get_k_similar_movies(client, movie_vector, k):
             }
         }
     }
-    response = client.search(index='movie', body=query)
-    return response.get("hits", {}).get("hits", [])
\ No newline at end of file
+
+
+def movie_vector_from_response(response):
+    if response['hits']['hits']:
+        return response['hits']['hits'][0]["_source"]["vector"]
+    return None
+
+
+def get_movie_vector(client, movie_id):
+    response = client.search(index=INDEX_ALIAS, body=movie_vector_query(movie_id))
+    return movie_vector_from_response(response)
+
+
+def get_k_similar_movies(client, movie_vector, k):
+    response = client.search(index=INDEX_ALIAS, body=k_similar_movies_query(movie_vector, k))
+    return response.get("hits", {}).get("hits", [])
+
+
+async def async_get_movie_vector(client, movie_id):
+    """
+    Igual que get_movie_vector pero con AsyncOpenSearch
+    """
+    response = await client.search(index=INDEX_ALIAS, body=movie_vector_query(movie_id))
+    return movie_vector_from_response(response)
+
+
+async def async_get_k_similar_movies(client, movie_vector, k):
+    """
+    Igual que get_k_similar_movies pero con AsyncOpenSearch
+    """
+    response = await client.search(index=INDEX_ALIAS, body=k_similar_movies_query(movie_vector, k))
+    return response.get("hits", {}).get("hits", [])
+
+
+def get_all_movie_vectors(client):
+    """
+    Recorre todo el indice con scroll y devuelve un dict movie_id -> vector
+    """
+    hits = helpers.scan(client, index=INDEX_ALIAS, query={"query": {"match_all": {}}}, _source=["movie_id", "vector"])
+    return {hit["_source"]["movie_id"]: hit["_source"]["vector"] for hit in hits}
+
+
+async def async_get_all_movie_vectors(client):
+    """
+    Igual que get_all_movie_vectors pero con AsyncOpenSearch
+    """
+    hits = helpers.async_scan(client, index=INDEX_ALIAS, query={"query": {"match_all": {}}}, _source=["movie_id", "vector"])
+    return {hit["_source"]["movie_id"]: hit["_source"]["vector"] async for hit in hits}
@@ -1,7 +1,7 @@
 import pandas as pd
 from datetime import datetime
 from matplotlib import pyplot as plt
-from sqlalchemy import Column, Integer, String, DateTime, ARRAY
+from sqlalchemy import Column, Integer, String, DateTime, ARRAY, any_, select
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
@@ -43,17 +43,50 @@ class Pelicula(Base):
         return new_df
 
     @classmethod
-    def get_by_id(cls, session, movie_id):
-        row = session.query(Pelicula).filter_by(id=movie_id).first()
-
+    def create_dict_from_row(cls, row):
+        """
+        Transforma una fila de la tabla Pelicula al json que devuelve la API
+        """
         return {
             "id": row.id,
             "nombre": row.nombre,
             "fecha_lanzamiento": row.fecha_lanzamiento.strftime("%Y-%m-%d"),
             "imdb_url": row.imdb_url,
-            "generos": ''.join(row.generos)
+            # generos es un array en la tabla declarada en el ORM, y un string separado por comas en tablas cargadas con to_sql
+            "generos": row.generos if isinstance(row.generos, str) else ','.join(row.generos)
         }
 
+    @classmethod
+    def get_by_id(cls, session, movie_id):
+        row = session.query(Pelicula).filter_by(id=movie_id).first()
+        if not row:
+            return None
+        return cls.create_dict_from_row(row)
+
+    @classmethod
+    def get_by_ids_statement(cls, movie_ids):
+        return select(Pelicula).where(Pelicula.id == any_([int(movie_id) for movie_id in movie_ids]))
+
+    @classmethod
+    def create_dicts_in_order(cls, rows, movie_ids):
+        """
+        Transforma las filas de get_by_ids_statement a dicts en el orden de movie_ids, omitiendo los ids que no existan
+        """
+        peliculas_por_id = {row.id: cls.create_dict_from_row(row) for row in rows}
+        # copio cada dict para que ids repetidos no compartan el mismo objeto
+        return [dict(peliculas_por_id[int(movie_id)]) for movie_id in movie_ids if int(movie_id) in peliculas_por_id]
+
+    @classmethod
+    def get_by_ids(cls, session, movie_ids):
+        """
+        Trae todas las peliculas de movie_ids en una sola query (WHERE id = ANY(...)).
+        Respeta el orden de movie_ids y omite los ids que no existan
+        """
+        if not movie_ids:
+            return []
+        rows = session.execute(cls.get_by_ids_statement(movie_ids)).scalars().all()
+        return cls.create_dicts_in_order(rows, movie_ids)
+
     def class_instance_to_df_row(self):
         """
         Transforma una instancia de la clase a un Dataframe row de pandas
@@ -101,7 +134,7 @@ class Pelicula(Base):
         df_peliculas.dropna(subset=['Release Date'], inplace=True)
         df_peliculas["Release Date"] = df_peliculas["Release Date"].apply(lambda x: datetime.strptime(x, "%d-%b-%Y"))
         
-        df_peliculas["IMDB URL"].fillna("http://us.imdb.com/M/title-exact?Unknown", inplace=True)
+        df_peliculas["IMDB URL"] = df_peliculas["IMDB URL"].fillna("http://us.imdb.com/M/title-exact?Unknown")
         
         return df_peliculas
 
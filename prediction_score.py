@@ -1,11 +1,22 @@
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import Column, Integer, DateTime, Enum, PrimaryKeyConstraint, String, Float
-from sqlalchemy import desc
+from sqlalchemy import desc, func, any_, select
+from itertools import groupby
+from pelicula import Pelicula
+from score import Score
 
 Base = declarative_base()
 
 
 class PredictionScore(Base):
+    """
+    Predicciones de rating por (pelicula, usuario), con los ids de la DB (los de Score y Pelicula): las cargas desde
+    artefactos de la notebook traducen sus ids con NotebookIds. Prediction_Score es una vista sobre la version activa
+    Prediction_Score_v<N> (ver publish_predictions en db_predictions_persistance.py), por lo que las recargas
+    completas no afectan a las lecturas. La version puede estar particionada por hash de user_id: los filtros por
+    user_id de las queries se resuelven en una sola particion. Una vista no tiene indices: el indice del top-k por
+    usuario (user_id, ratings_pred DESC) se crea en cada version con create_version_indexes
+    """
     __tablename__ = 'Prediction_Score'
 
     movie_id = Column(Integer, primary_key=True)
@@ -25,19 +36,68 @@ class PredictionScore(Base):
         """
         Crea una instancia de la clase a partir de una fila de un dataframe
         """
-        return PredictionScore(row["movie_id"], row["user_id"], row['ratings_pred'])
+        return PredictionScore(row["user_id"], row["movie_id"], row['ratings_pred'])
 
     @classmethod
-    def get_by_user_id_and_ranked_movies(cls, session, user_id, ranked_movies):
-        predictions = (session
-                       .query(PredictionScore)
-                       .filter(PredictionScore.user_id == user_id)
-                       .filter(~PredictionScore.movie_id.in_(ranked_movies))
-                       .order_by(desc(PredictionScore.ratings_pred))
-                       .all())
-        rows = [{"movie_id": row.movie_id,
-                 "user_id": row.user_id,
-                 "ratings_pred": row.ratings_pred
-                 }
-                for row in predictions]
-        return rows
\ No newline at end of file
+    def get_top_k_by_user_id_statement(cls, user_id, k, exclude_seen=True):
+        """
+        Query de las k peliculas con mayor prediccion de ranking del usuario, cruzadas con Pelicula.
+        Con exclude_seen agrega el anti-join contra Score para descartar las ya vistas
+        """
+        statement = (select(Pelicula)
+                     .join(PredictionScore, PredictionScore.movie_id == Pelicula.id)
+                     .where(PredictionScore.user_id == int(user_id)))
+        if exclude_seen:
+            ya_vista = (select(Score.id)
+                        .where(Score.user_id == PredictionScore.user_id)
+                        .where(Score.pelicula_id == PredictionScore.movie_id)
+                        .exists())
+            statement = statement.where(~ya_vista)
+        return statement.order_by(desc(PredictionScore.ratings_pred)).limit(k)
+
+    @classmethod
+    def get_top_k_unseen_by_user_id(cls, session, user_id, k):
+        """
+        Devuelve las k peliculas aun no vistas por el usuario con mayor prediccion de ranking, ya cruzadas con Pelicula.
+        Se resuelve en una sola query: anti-join contra Score, ORDER BY ratings_pred DESC y LIMIT k
+        """
+        rows = session.execute(cls.get_top_k_by_user_id_statement(user_id, k)).scalars().all()
+        return [Pelicula.create_dict_from_row(row) for row in rows]
+
+    @classmethod
+    def get_top_k_unseen_by_user_ids_statement(cls, user_ids, k):
+        """
+        Query set-based del top-k no visto de muchos usuarios: numera las predicciones no vistas de cada usuario
+        con row_number() y se queda con las primeras k
+        """
+        ya_vista = (select(Score.id)
+                    .where(Score.user_id == PredictionScore.user_id)
+                    .where(Score.pelicula_id == PredictionScore.movie_id)
+                    .exists())
+        ranking = (func.row_number()
+                   .over(partition_by=PredictionScore.user_id, order_by=desc(PredictionScore.ratings_pred))
+                   .label('ranking'))
+        candidatas = (select(PredictionScore.user_id, PredictionScore.movie_id, ranking)
+                      .join(Pelicula, Pelicula.id == PredictionScore.movie_id)
+                      .where(PredictionScore.user_id == any_([int(user_id) for user_id in user_ids]))
+                      .where(~ya_vista)
+                      .subquery())
+        return (select(candidatas.c.user_id, candidatas.c.ranking, Pelicula)
+                .join(Pelicula, Pelicula.id == candidatas.c.movie_id)
+                .where(candidatas.c.ranking <= k)
+                .order_by(candidatas.c.user_id, candidatas.c.ranking))
+
+    @classmethod
+    def group_recommendations_by_user(cls, rows):
+        return {user_id: [dict(Pelicula.create_dict_from_row(row.Pelicula), ranking=row.ranking) for row in user_rows]
+                for user_id, user_rows in groupby(rows, key=lambda row: row.user_id)}
+
+    @classmethod
+    def get_top_k_unseen_by_user_ids(cls, session, user_ids, k):
+        """
+        Version set-based de get_top_k_unseen_by_user_id para muchos usuarios en una sola query.
+        Devuelve un dict user_id -> lista de peliculas con su ranking; los usuarios sin recomendaciones no aparecen
+        """
+        rows = session.execute(cls.get_top_k_unseen_by_user_ids_statement(user_ids, k)).all()
+        return cls.group_recommendations_by_user(rows)
+
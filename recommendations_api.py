@@ -1,18 +1,32 @@
-from flask import Flask, jsonify, request, abort
-from flask_sqlalchemy import SQLAlchemy
+from flask import Flask, jsonify, request, abort, Response, stream_with_context
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, scoped_session
 from flask_restx import Api, Resource
 from flask_swagger_ui import get_swaggerui_blueprint
 from pelicula import Pelicula
 from score import Score
 from prediction_score import PredictionScore
+from similar_movie import SimilarMovie
 import json
+import os
+import threading
+import time
 from opensearchpy import OpenSearch
-from opensearch_api import get_movie_vector, get_k_similar_movies
+from similarity_backends import OpenSearchSimilarityBackend, LocalSimilarityBackend
+from ttl_lru_cache import TTLLRUCache
+from single_flight import SingleFlight
+from in_memory_recommendations import InMemoryRecommendations
+from online_scoring import MicroBatcher, OnlineScorer, missing_files
+from user_fold_in import UserFoldIn
+from catalog import Catalog
+from notebook_ids import NotebookIds
+from api_metrics import init_metrics, instrument_engine, timed, TimedTransport
+from recommendations_notifications import RecommendationsListener, notify_all, notify_users
 
 app = Flask(__name__)
 api = Api(app, title='ITBA Recommendations API', description='API documentation using Swagger')
+# Conteos, latencias por ruta y tiempo en Postgres, OpenSearch y serializacion en GET /metrics
+init_metrics(app)
 
 # Read the opensearch properties file
 with open('connection_properties.json', 'r') as file:
@@ -23,19 +37,217 @@ postgres_password = connection_properties["postgres"]["password"]
 postgres_host = connection_properties["postgres"]["_host_docker"]
 postgres_port = connection_properties["postgres"]["port"]
 postgres_db = connection_properties["postgres"]["db"]
-app.config['SQLALCHEMY_DATABASE_URI'] = f'postgresql://{postgres_user}:{postgres_password}@{postgres_host}:{postgres_port}/{postgres_db}'
-db = SQLAlchemy(app)
-
-client = OpenSearch(
-        hosts=[{'host': connection_properties["opensearch"]["_host_docker"], 'port': connection_properties["opensearch"]["port"]}],
-        http_auth=(connection_properties["opensearch"]["username"], connection_properties["opensearch"]["password"]),
-        use_ssl=True,
-        verify_certs=False,
-)
+postgres_url = f'postgresql://{postgres_user}:{postgres_password}@{postgres_host}:{postgres_port}/{postgres_db}'
+
+api_properties = connection_properties.get("api", {})
+
+def create_opensearch_client():
+    return OpenSearch(
+            hosts=[{'host': connection_properties["opensearch"]["_host_docker"], 'port': connection_properties["opensearch"]["port"]}],
+            http_auth=(connection_properties["opensearch"]["username"], connection_properties["opensearch"]["password"]),
+            use_ssl=True,
+            verify_certs=False,
+            transport_class=TimedTransport,
+    )
+
+
+client = create_opensearch_client()
+
+# Backend de /similar_movies: "opensearch" (kNN en el cluster), "local" (coseno en memoria sobre embedding_movies_genre)
+# o "precomputed" (tabla Similar_Movie generada por db_similar_movies_persistance.py)
+similarity_backend_name = connection_properties.get("api", {}).get("similarity_backend", "opensearch")
+if similarity_backend_name == "local":
+    similarity_backend = LocalSimilarityBackend('embedding_movies_genre', 'peliculas_df',
+                                                approximate=connection_properties["api"].get("similarity_approximate", False))
+elif similarity_backend_name == "opensearch":
+    vector_cache_properties = connection_properties.get("api", {}).get("opensearch_vector_cache", {})
+    similarity_backend = OpenSearchSimilarityBackend(client,
+                                                     vector_cache_size=vector_cache_properties.get("max_size", 2000),
+                                                     vector_cache_ttl_seconds=vector_cache_properties.get("ttl_seconds", 3600))
+else:
+    similarity_backend = None
+
+# Unico engine (y pool de conexiones) de la API, configurable en api.postgres_pool. Con gunicorn, gunicorn.conf.py
+# dimensiona el pool de cada worker segun sus threads (API_POOL_SIZE / API_POOL_MAX_OVERFLOW)
+pool_properties = api_properties.get("postgres_pool", {})
+pool_size = int(os.environ.get("API_POOL_SIZE", pool_properties.get("pool_size", 10)))
+pool_max_overflow = int(os.environ.get("API_POOL_MAX_OVERFLOW", pool_properties.get("max_overflow", 20)))
+engine = create_engine(postgres_url,
+                       pool_size=pool_size,
+                       max_overflow=pool_max_overflow,
+                       pool_timeout=pool_properties.get("pool_timeout", 30),
+                       pool_pre_ping=pool_properties.get("pool_pre_ping", True),
+                       pool_recycle=pool_properties.get("pool_recycle", 1800))
+instrument_engine(engine)
+session_factory = sessionmaker(bind=engine)
+# Una session por request (por thread), que se devuelve al pool en teardown_appcontext
+Session = scoped_session(session_factory)
+
+
+@app.teardown_appcontext
+def remove_session(exception=None):
+    Session.remove()
+
+# Cache de recomendaciones por (user_id, k), una por worker. Las escrituras de predicciones (upsert_predictions,
+# publish_predictions) y de Score (triggers) notifican por LISTEN/NOTIFY a todos los workers, que invalidan a esos
+# usuarios (ver recommendations_listener); el TTL queda como cota si se pierde una notificacion
+recommendations_cache_properties = api_properties.get("recommendations_cache", {})
+recommendations_cache = TTLLRUCache(max_size=recommendations_cache_properties.get("max_size", 10000),
+                                    ttl_seconds=recommendations_cache_properties.get("ttl_seconds", 300))
+
+
+def invalidate_recommendations_cache(user_ids):
+    user_ids = {int(user_id) for user_id in user_ids if user_id is not None}
+    return recommendations_cache.invalidate(lambda key: key[0] in user_ids)
+
+
+# Traduccion entre ids de la DB y los del modelo (artefactos de la notebook, no versionados en el repo), para el
+# scoring en vivo, el fold-in y el modo memory desde all_predictions
+online_scoring_properties = api_properties.get("online_scoring", {})
+notebook_map_files = (online_scoring_properties.get("users_map_file", "dict_users"),
+                      online_scoring_properties.get("movies_map_file", "dict_pelis"))
+
+# Modo de serving de /recommendations: "postgres" (query por request) o "memory" (predicciones cargadas en memoria al iniciar)
+recommendations_backend = api_properties.get("recommendations_backend", "postgres")
+recommendations_memory_source = api_properties.get("recommendations_memory_source", "db")
+in_memory_recommendations = InMemoryRecommendations() if recommendations_backend == "memory" else None
+
+
+def reload_in_memory_recommendations():
+    session = Session()
+    try:
+        if recommendations_memory_source == "all_predictions":
+            # El artefacto tiene ids de la notebook: se traducen con los mismos mapas que el scoring en vivo
+            in_memory_recommendations.reload_from_artifact(session, NotebookIds.load(*notebook_map_files),
+                                                           'all_predictions')
+        else:
+            in_memory_recommendations.reload_from_db(session)
+    finally:
+        Session.remove()
+
+
+def apply_changed_users(user_ids):
+    invalidate_recommendations_cache(user_ids)
+    if in_memory_recommendations:
+        session = Session()
+        try:
+            in_memory_recommendations.refresh_users(session, user_ids)
+        finally:
+            Session.remove()
+
+
+def apply_changed_all():
+    if in_memory_recommendations and in_memory_recommendations.snapshot is not None:
+        reload_in_memory_recommendations()
+    recommendations_cache.clear()
+
+
+# Con varios workers la cache y el snapshot en memoria viven en cada proceso: cada worker escucha los cambios que
+# hacen los demas (reload, fold-in, DELETE de la cache) y los procesos batch. Se arranca en post_fork
+recommendations_listener = RecommendationsListener(postgres_url, apply_changed_users, apply_changed_all)
+
+
+def broadcast(notify, *args):
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        notify(cursor, *args)
+        connection.commit()
+    finally:
+        connection.close()
+
+
+# Scoring en vivo para usuarios sin predicciones (o con menos de k peliculas no vistas predichas), con los pesos exportados
+# por numpy_rating_model.py. Las requests concurrentes se agrupan en micro-batches: un forward pass por batch
+online_scoring_model_file = online_scoring_properties.get("model_file", "model_weights.npz")
+missing_online_scoring_files = missing_files(online_scoring_model_file, *notebook_map_files)
+if os.path.exists(online_scoring_model_file) and missing_online_scoring_files:
+    app.logger.warning(f"Online scoring deshabilitado, faltan: {', '.join(missing_online_scoring_files)}")
+if not missing_online_scoring_files:
+    online_scorer = OnlineScorer.load(online_scoring_model_file, 'peliculas_df', *notebook_map_files)
+    online_batcher = MicroBatcher(online_scorer.score_batch,
+                                  max_batch_size=online_scoring_properties.get("max_batch_size", 64),
+                                  max_wait_ms=online_scoring_properties.get("max_wait_ms", 5))
+    # Mismos pesos para el fold-in de POST /users/<user_id>/fold_in
+    user_fold_in = UserFoldIn(online_scorer.model, online_scorer.movie_ids, online_scorer.genres,
+                              online_scorer.notebook_ids)
+else:
+    online_batcher = None
+    user_fold_in = None
+
+
+# Catalogo de peliculas en memoria (api.catalog_in_memory), cargado en warm_up
+catalog = None
+warmed_up = threading.Event()
+
+
+# Requests concurrentes identicas a /similar_movies y /movies/<id> (por parametros normalizados) comparten una sola
+# ejecucion en vuelo, para no repetir las mismas queries a OpenSearch y Postgres cuando una pelicula se vuelve popular
+request_flight = SingleFlight()
+
+
+def get_peliculas_by_ids(session, movie_ids):
+    if catalog:
+        return catalog.get_by_ids(movie_ids)
+    return Pelicula.get_by_ids(session, movie_ids)
+
+
+def score_online(session, user_id, k):
+    seen_movie_ids = Score.get_by_user_id(session, user_id)
+    movie_ids = online_batcher.submit((int(user_id), seen_movie_ids, k)).result()
+    return get_peliculas_by_ids(session, movie_ids)
+
+
+def warm_up():
+    """
+    Carga todo lo de solo lectura que usan las requests: catalogo de peliculas, vectores de OpenSearch y
+    recomendaciones en memoria. No corre al importar el modulo: con gunicorn lo llama when_ready en el master, antes
+    del fork, y los workers lo heredan copy-on-write (ver gunicorn.conf.py). /ready responde OK recien cuando termina
+    """
+    global catalog
+    if api_properties.get("catalog_in_memory", True):
+        session = Session()
+        try:
+            catalog = Catalog.load(session)
+        finally:
+            Session.remove()
+    if similarity_backend_name == "opensearch" and vector_cache_properties.get("preload", False):
+        similarity_backend.preload_vectors()
+    if in_memory_recommendations:
+        # Mismo catalogo que get_peliculas_by_ids: una sola query y una sola copia en el master
+        in_memory_recommendations.catalog = catalog
+        reload_in_memory_recommendations()
+    warmed_up.set()
+
+
+def warm_up_in_background(retry_seconds=5):
+    """
+    Corre warm_up en un thread, reintentando mientras Postgres u OpenSearch no respondan. Mientras tanto la API
+    atiende requests (sin catalogo en memoria) y /ready responde 503
+    """
+    def run():
+        while True:
+            try:
+                warm_up()
+                return
+            except Exception as e:
+                app.logger.warning(f"Warm-up fallido, se reintenta en {retry_seconds}s: {e}")
+                time.sleep(retry_seconds)
+
+    threading.Thread(target=run, name='warm-up', daemon=True).start()
+
+
+def reset_connections_after_fork():
+    """
+    Se llama en cada worker de gunicorn despues del fork: las conexiones a Postgres y OpenSearch abiertas por el
+    master durante el warm-up no pueden compartirse entre procesos
+    """
+    global client
+    engine.dispose(close=False)
+    client = create_opensearch_client()
+    if isinstance(similarity_backend, OpenSearchSimilarityBackend):
+        similarity_backend.client = client
 
-# Create the engine and session
-engine = create_engine(app.config['SQLALCHEMY_DATABASE_URI'])
-Session = sessionmaker(bind=engine)
 
 SWAGGER_URL="/swagger"
 API_URL="/static/swagger.json"
@@ -58,54 +270,148 @@ def get_movie_recommendations():
     if not user_id or not k:
         abort(400, "You must specify both user_id and k")
 
-    session = Session()
+    cache_key = (int(user_id), k)
+    if in_memory_recommendations and in_memory_recommendations.snapshot is None:
+        abort(503, "Recommendations are still loading")
+    if in_memory_recommendations:
+        # Scan en memoria, sin SQL ni cache
+        peliculas_con_info = in_memory_recommendations.recommend(user_id, k)
+        if len(peliculas_con_info) < k and online_batcher:
+            peliculas_con_info = recommendations_cache.get(cache_key)
+    else:
+        peliculas_con_info = recommendations_cache.get(cache_key)
+    if peliculas_con_info is None:
+        session = Session()
 
-    # Traer todos los ids de peliculas de rankings hechos por el usuario
-    ranked_movies = Score.get_by_user_id(session, user_id)
+        # Traer las k peliculas aun no vistas por el usuario con mayor predicción de ranking, en una sola query
+        peliculas_con_info = [] if in_memory_recommendations else PredictionScore.get_top_k_unseen_by_user_id(session, user_id, k)
+        if len(peliculas_con_info) < k and online_batcher:
+            # Usuario nuevo o con predicciones desactualizadas: se predice en vivo todo el catalogo no visto
+            peliculas_con_info = score_online(session, user_id, k)
+        for i, peli in enumerate(peliculas_con_info):
+            peli["ranking"] = i+1
+        recommendations_cache.put(cache_key, peliculas_con_info)
 
-    # Traer predicciones para el usuario de peliculas aun no vistas y ordenadas descendentemente por predicción de ranking
-    predictions = PredictionScore.get_by_user_id_and_ranked_movies(session, user_id, ranked_movies)
-    if not predictions:
+    if not peliculas_con_info:
         return "User has already ranked all movies", 200
 
-    peliculas_con_info = [Pelicula.get_by_id(session, prediction["movie_id"]) for prediction in predictions[:k]]
-    for i, peli in enumerate(peliculas_con_info):
-        peli["ranking"] = i+1
-
     return peliculas_con_info
 
 
+@app.route('/recommendations/batch', methods=['POST'])
+def get_batch_movie_recommendations():
+    # Recibe {"user_ids": [...], "k": K} y devuelve una linea NDJSON por usuario, en el orden pedido
+    body = request.get_json(silent=True) or {}
+    user_ids = body.get('user_ids')
+    k = body.get('k')
+
+    if not user_ids or not k:
+        abort(400, "You must specify both user_ids and k")
+    user_ids = [int(user_id) for user_id in user_ids]
+    k = int(k)
+    chunk_size = api_properties.get("recommendations_batch_chunk_size", 500)
+    if in_memory_recommendations and in_memory_recommendations.snapshot is None:
+        abort(503, "Recommendations are still loading")
+
+    def generate():
+        session = None if in_memory_recommendations else Session()
+        try:
+            # Una query por chunk de usuarios: la memoria queda acotada por chunk_size * k
+            for start in range(0, len(user_ids), chunk_size):
+                chunk = user_ids[start:start + chunk_size]
+                if in_memory_recommendations:
+                    recommendations = {user_id: in_memory_recommendations.recommend(user_id, k) for user_id in chunk}
+                else:
+                    recommendations = PredictionScore.get_top_k_unseen_by_user_ids(session, chunk, k)
+                for user_id in chunk:
+                    yield json.dumps({"user_id": user_id, "recommendations": recommendations.get(user_id, [])}) + "\n"
+        finally:
+            if session:
+                session.close()
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+@app.route('/recommendations/reload', methods=['POST'])
+def reload_recommendations():
+    # Hook para llamar tras persistir nuevas predicciones
+    if in_memory_recommendations:
+        reload_in_memory_recommendations()
+    recommendations_cache.clear()
+    # El resto de los workers recargan al recibir la notificacion
+    broadcast(notify_all)
+    return jsonify(status='OK', backend=recommendations_backend)
+
+
+@app.route('/users/<int:user_id>/fold_in', methods=['POST'])
+def fold_in_user(user_id):
+    # Recalcula el embedding del usuario a partir de sus scores y reescribe sus predicciones, sin reentrenar
+    if not user_fold_in:
+        abort(503, "Online scoring is disabled (model weights not found)")
+    session = Session()
+    connection = engine.raw_connection()
+    try:
+        n_ratings, n_predictions = user_fold_in.refresh_user(session, connection, user_id)
+    finally:
+        connection.close()
+    if in_memory_recommendations:
+        # Sin esto el snapshot seguiria sirviendo el top-k anterior hasta el proximo reload completo
+        in_memory_recommendations.refresh_users(session, [user_id])
+    # El resto de los workers invalidan al usuario con la notificacion de upsert_predictions
+    invalidate_recommendations_cache([user_id])
+    return jsonify(user_id=user_id, ratings=n_ratings, predictions=n_predictions)
+
+
 @app.route('/similar_movies', methods=['GET'])
 def get_similar_movies():
     movie_id = request.args.get('movie_id')
-    k = int(request.args.get('k')) + 1
+    k = int(request.args.get('k'))
 
     if not movie_id or not k:
         abort(400, "You must specify both movie_id and k")
 
-    movie_vector = get_movie_vector(client, movie_id)
-    if movie_vector:
-        similar_movies = get_k_similar_movies(client, movie_vector, k)
-        session = Session()
-        # Agrego ranking index y cruzo info con RDBMS
-        k_similar_movies = []
-        for i, hit in enumerate(similar_movies):
-            if not int(hit["_source"]["movie_id"]) == int(movie_id):
-                new_json = Pelicula.get_by_id(session, hit["_source"]["movie_id"])
-                new_json["ranking"] = i
-                k_similar_movies.append(new_json)
+    movie_id = int(movie_id)
+    k_similar_movies = request_flight.do(('similar_movies', movie_id, k), lambda: find_similar_movies(movie_id, k))
+    if k_similar_movies is None:
+        return jsonify({'error': 'Movie not found'}), 404
+    return k_similar_movies
 
-        return k_similar_movies
 
-    else: return jsonify({'error': 'Movie not found'}), 404
+def find_similar_movies(movie_id, k):
+    """
+    Devuelve las k peliculas mas similares a movie_id con su ranking, o None si la pelicula no existe
+    """
+    session = Session()
+    if similarity_backend_name == "precomputed":
+        # Un solo range scan sobre Similar_Movie cruzado con Pelicula
+        return SimilarMovie.get_by_movie_id(session, movie_id, k) or None
+
+    similar_movies = similarity_backend.get_similar_movies(movie_id, k)
+    if similar_movies is None:
+        return None
+
+    # Agrego ranking index y cruzo info con RDBMS en una sola query
+    peliculas_por_id = {peli["id"]: peli for peli in get_peliculas_by_ids(session, [similar_id for similar_id, _ in similar_movies])}
+    k_similar_movies = []
+    for i, (similar_id, _) in enumerate(similar_movies):
+        if similar_id in peliculas_por_id:
+            new_json = peliculas_por_id[similar_id]
+            new_json["ranking"] = i+1
+            k_similar_movies.append(new_json)
+
+    return k_similar_movies
 
 
 @app.route('/movies/<int:movie_id>', methods=['GET'])
 def get_movie(movie_id):
-    session = Session()
-    movie = Pelicula.get_by_id(session, movie_id)
-    if movie:
-        return json.dumps(movie), 200
+    if catalog:
+        movies = catalog.get_by_ids([movie_id])
+    else:
+        movies = request_flight.do(('movie', movie_id), lambda: Pelicula.get_by_ids(Session(), [movie_id]))
+    if movies:
+        with timed('serialization'):
+            movie_json = json.dumps(movies[0])
+        return movie_json, 200
     else:
         return jsonify({'error': 'Movie not found'}), 404
 
@@ -119,10 +425,46 @@ def get_rating(user_id):
     else:
         return jsonify({'error': 'Movie not found'}), 404
 
+@app.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    stats = {"recommendations": recommendations_cache.stats()}
+    if isinstance(similarity_backend, OpenSearchSimilarityBackend):
+        stats["opensearch_vectors"] = similarity_backend.vector_cache.stats()
+    if online_batcher:
+        stats["online_scoring"] = online_batcher.stats()
+    stats["single_flight"] = request_flight.stats()
+    stats["notifications"] = recommendations_listener.stats()
+    return jsonify(stats)
+
+
+@app.route('/cache/recommendations/<int:user_id>', methods=['DELETE'])
+def invalidate_user_recommendations(user_id):
+    invalidated = invalidate_recommendations_cache([user_id])
+    broadcast(notify_users, [user_id])
+    return jsonify(user_id=user_id, invalidated=invalidated)
+
+
+@app.route('/pool/stats', methods=['GET'])
+def get_pool_stats():
+    pool = engine.pool
+    return jsonify(size=pool.size(), checked_in=pool.checkedin(), checked_out=pool.checkedout(),
+                   overflow=pool.overflow(), max_overflow=pool_max_overflow)
+
+
 @app.route('/health')
 def health_check():
     return jsonify(status='OK')
 
 
+@app.route('/ready')
+def readiness_check():
+    # A diferencia de /health, solo responde OK cuando terminó el warm-up
+    if not warmed_up.is_set():
+        return jsonify(status='WARMING_UP'), 503
+    return jsonify(status='OK', catalog_movies=len(catalog) if catalog else None)
+
+
 if __name__ == '__main__':
+    recommendations_listener.start()
+    warm_up_in_background()
     app.run(debug=True, host="0.0.0.0", port=90)
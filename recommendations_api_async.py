@@ -0,0 +1,258 @@
+import asyncio
+import json
+import os
+from quart import Quart, jsonify, request, abort, Response
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from opensearchpy import AsyncOpenSearch
+from pelicula import Pelicula
+from score import Score
+from prediction_score import PredictionScore
+from similar_movie import SimilarMovie
+from similarity_backends import AsyncOpenSearchSimilarityBackend, LocalSimilarityBackend
+from ttl_lru_cache import TTLLRUCache
+from online_scoring import MicroBatcher, OnlineScorer, missing_files
+
+# Variante ASGI de recommendations_api.py: mismas rutas de lectura, con SQLAlchemy async (asyncpg) y AsyncOpenSearch.
+# Un worker no queda bloqueado durante las queries: mientras una request espera a Postgres u OpenSearch atiende otras
+app = Quart(__name__)
+
+# Read the opensearch properties file
+with open('connection_properties.json', 'r') as file:
+    connection_properties = json.load(file)
+
+postgres_user = connection_properties["postgres"]["username"]
+postgres_password = connection_properties["postgres"]["password"]
+postgres_host = connection_properties["postgres"]["_host_docker"]
+postgres_port = connection_properties["postgres"]["port"]
+postgres_db = connection_properties["postgres"]["db"]
+postgres_url = f'postgresql+asyncpg://{postgres_user}:{postgres_password}@{postgres_host}:{postgres_port}/{postgres_db}'
+
+api_properties = connection_properties.get("api", {})
+
+pool_properties = api_properties.get("postgres_pool", {})
+engine = create_async_engine(postgres_url,
+                             pool_size=pool_properties.get("pool_size", 10),
+                             max_overflow=pool_properties.get("max_overflow", 20),
+                             pool_timeout=pool_properties.get("pool_timeout", 30),
+                             pool_pre_ping=pool_properties.get("pool_pre_ping", True),
+                             pool_recycle=pool_properties.get("pool_recycle", 1800))
+Session = async_sessionmaker(engine, expire_on_commit=False)
+
+client = AsyncOpenSearch(
+        hosts=[{'host': connection_properties["opensearch"]["_host_docker"], 'port': connection_properties["opensearch"]["port"]}],
+        http_auth=(connection_properties["opensearch"]["username"], connection_properties["opensearch"]["password"]),
+        use_ssl=True,
+        verify_certs=False,
+)
+
+similarity_backend_name = api_properties.get("similarity_backend", "opensearch")
+vector_cache_properties = api_properties.get("opensearch_vector_cache", {})
+if similarity_backend_name == "local":
+    similarity_backend = LocalSimilarityBackend('embedding_movies_genre', 'peliculas_df',
+                                                approximate=api_properties.get("similarity_approximate", False))
+elif similarity_backend_name == "opensearch":
+    similarity_backend = AsyncOpenSearchSimilarityBackend(client,
+                                                          vector_cache_size=vector_cache_properties.get("max_size", 2000),
+                                                          vector_cache_ttl_seconds=vector_cache_properties.get("ttl_seconds", 3600))
+else:
+    similarity_backend = None
+
+recommendations_cache_properties = api_properties.get("recommendations_cache", {})
+recommendations_cache = TTLLRUCache(max_size=recommendations_cache_properties.get("max_size", 10000),
+                                    ttl_seconds=recommendations_cache_properties.get("ttl_seconds", 300))
+# Predicciones de mas que se traen en /recommendations para descartar en memoria las ya vistas
+recommendations_overfetch = api_properties.get("async_recommendations_overfetch", 50)
+
+online_scoring_properties = api_properties.get("online_scoring", {})
+online_scoring_model_file = online_scoring_properties.get("model_file", "model_weights.npz")
+online_scoring_map_files = (online_scoring_properties.get("users_map_file", "dict_users"),
+                            online_scoring_properties.get("movies_map_file", "dict_pelis"))
+missing_online_scoring_files = missing_files(online_scoring_model_file, *online_scoring_map_files)
+if os.path.exists(online_scoring_model_file) and missing_online_scoring_files:
+    app.logger.warning(f"Online scoring deshabilitado, faltan: {', '.join(missing_online_scoring_files)}")
+if not missing_online_scoring_files:
+    online_batcher = MicroBatcher(OnlineScorer.load(online_scoring_model_file, 'peliculas_df',
+                                                    *online_scoring_map_files).score_batch,
+                                  max_batch_size=online_scoring_properties.get("max_batch_size", 64),
+                                  max_wait_ms=online_scoring_properties.get("max_wait_ms", 5))
+else:
+    online_batcher = None
+
+
+@app.before_serving
+async def preload_vectors():
+    if similarity_backend_name == "opensearch" and vector_cache_properties.get("preload", False):
+        await similarity_backend.preload_vectors()
+
+
+@app.after_serving
+async def close_clients():
+    await client.close()
+    await engine.dispose()
+
+
+async def fetch_scalars(statement):
+    # Una session (y una conexion del pool) por query, para poder correr queries independientes en paralelo
+    async with Session() as session:
+        return (await session.execute(statement)).scalars().all()
+
+
+async def fetch_rows(statement):
+    async with Session() as session:
+        return (await session.execute(statement)).all()
+
+
+async def get_peliculas_by_ids(movie_ids):
+    if not movie_ids:
+        return []
+    return Pelicula.create_dicts_in_order(await fetch_scalars(Pelicula.get_by_ids_statement(movie_ids)), movie_ids)
+
+
+async def get_top_k_unseen(user_id, k):
+    """
+    Trae en paralelo las peliculas vistas por el usuario y sus k + recommendations_overfetch mejores predicciones, y
+    descarta las vistas en memoria. Solo si las vistas desplazan a todas las traidas de mas se recurre al anti-join
+    completo en Postgres. Devuelve (movie_ids vistos, peliculas no vistas)
+    """
+    limit = k + recommendations_overfetch
+    seen_movie_ids, peliculas = await asyncio.gather(
+        fetch_scalars(Score.get_by_user_id_statement(user_id)),
+        fetch_scalars(PredictionScore.get_top_k_by_user_id_statement(user_id, limit, exclude_seen=False)))
+    seen = set(seen_movie_ids)
+    unseen = [pelicula for pelicula in peliculas if pelicula.id not in seen]
+    if len(unseen) < k and len(peliculas) == limit:
+        unseen = await fetch_scalars(PredictionScore.get_top_k_by_user_id_statement(user_id, k))
+    return seen_movie_ids, [Pelicula.create_dict_from_row(pelicula) for pelicula in unseen[:k]]
+
+
+@app.route('/recommendations', methods=['GET'])
+async def get_movie_recommendations():
+    user_id = request.args.get('user_id')
+    k = int(request.args.get('k'))
+
+    if not user_id or not k:
+        abort(400, "You must specify both user_id and k")
+
+    cache_key = (int(user_id), k)
+    peliculas_con_info = recommendations_cache.get(cache_key)
+    if peliculas_con_info is None:
+        seen_movie_ids, peliculas_con_info = await get_top_k_unseen(user_id, k)
+        if len(peliculas_con_info) < k and online_batcher:
+            # Usuario nuevo o con predicciones desactualizadas: se predice en vivo sin bloquear el event loop
+            movie_ids = await asyncio.wrap_future(online_batcher.submit((int(user_id), seen_movie_ids, k)))
+            peliculas_con_info = await get_peliculas_by_ids(movie_ids)
+        for i, peli in enumerate(peliculas_con_info):
+            peli["ranking"] = i+1
+        recommendations_cache.put(cache_key, peliculas_con_info)
+
+    if not peliculas_con_info:
+        return "User has already ranked all movies", 200
+
+    return jsonify(peliculas_con_info)
+
+
+@app.route('/recommendations/batch', methods=['POST'])
+async def get_batch_movie_recommendations():
+    body = await request.get_json(silent=True) or {}
+    user_ids = body.get('user_ids')
+    k = body.get('k')
+
+    if not user_ids or not k:
+        abort(400, "You must specify both user_ids and k")
+    user_ids = [int(user_id) for user_id in user_ids]
+    k = int(k)
+    chunk_size = api_properties.get("recommendations_batch_chunk_size", 500)
+
+    async def generate():
+        async with Session() as session:
+            for start in range(0, len(user_ids), chunk_size):
+                chunk = user_ids[start:start + chunk_size]
+                rows = (await session.execute(PredictionScore.get_top_k_unseen_by_user_ids_statement(chunk, k))).all()
+                recommendations = PredictionScore.group_recommendations_by_user(rows)
+                for user_id in chunk:
+                    yield json.dumps({"user_id": user_id, "recommendations": recommendations.get(user_id, [])}) + "\n"
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+
+@app.route('/similar_movies', methods=['GET'])
+async def get_similar_movies():
+    movie_id = request.args.get('movie_id')
+    k = int(request.args.get('k'))
+
+    if not movie_id or not k:
+        abort(400, "You must specify both movie_id and k")
+
+    if similarity_backend_name == "precomputed":
+        k_similar_movies = SimilarMovie.create_dicts_from_rows(await fetch_rows(SimilarMovie.get_by_movie_id_statement(movie_id, k)))
+        if not k_similar_movies:
+            return jsonify({'error': 'Movie not found'}), 404
+        return jsonify(k_similar_movies)
+
+    if similarity_backend_name == "local":
+        # El top-k local es CPU: corre en un thread para no bloquear el event loop
+        similar_movies = await asyncio.to_thread(similarity_backend.get_similar_movies, movie_id, k)
+    else:
+        similar_movies = await similarity_backend.get_similar_movies(movie_id, k)
+    if similar_movies is None:
+        return jsonify({'error': 'Movie not found'}), 404
+
+    peliculas_por_id = {peli["id"]: peli for peli in await get_peliculas_by_ids([similar_id for similar_id, _ in similar_movies])}
+    k_similar_movies = []
+    for i, (similar_id, _) in enumerate(similar_movies):
+        if similar_id in peliculas_por_id:
+            new_json = peliculas_por_id[similar_id]
+            new_json["ranking"] = i+1
+            k_similar_movies.append(new_json)
+
+    return jsonify(k_similar_movies)
+
+
+@app.route('/movies/<int:movie_id>', methods=['GET'])
+async def get_movie(movie_id):
+    movies = await get_peliculas_by_ids([movie_id])
+    if movies:
+        return json.dumps(movies[0]), 200
+    else:
+        return jsonify({'error': 'Movie not found'}), 404
+
+
+@app.route('/scores/<int:user_id>', methods=['GET'])
+async def get_rating(user_id):
+    rankings = await fetch_scalars(Score.get_by_user_id_statement(user_id))
+    if rankings:
+        return jsonify(list(rankings)), 200
+    else:
+        return jsonify({'error': 'Movie not found'}), 404
+
+
+@app.route('/cache/stats', methods=['GET'])
+async def get_cache_stats():
+    stats = {"recommendations": recommendations_cache.stats()}
+    if isinstance(similarity_backend, AsyncOpenSearchSimilarityBackend):
+        stats["opensearch_vectors"] = similarity_backend.vector_cache.stats()
+    if online_batcher:
+        stats["online_scoring"] = online_batcher.stats()
+    return jsonify(stats)
+
+
+@app.route('/cache/recommendations/<int:user_id>', methods=['DELETE'])
+async def invalidate_user_recommendations(user_id):
+    return jsonify(user_id=user_id, invalidated=recommendations_cache.invalidate(lambda key: key[0] == user_id))
+
+
+@app.route('/pool/stats', methods=['GET'])
+async def get_pool_stats():
+    pool = engine.pool
+    return jsonify(size=pool.size(), checked_in=pool.checkedin(), checked_out=pool.checkedout(),
+                   overflow=pool.overflow(), max_overflow=pool_properties.get("max_overflow", 20))
+
+
+@app.route('/health')
+async def health_check():
+    return jsonify(status='OK')
+
+
+# Produccion: hypercorn recommendations_api_async:app --bind 0.0.0.0:90
+if __name__ == '__main__':
+    app.run(host="0.0.0.0", port=90)
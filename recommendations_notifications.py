@@ -0,0 +1,109 @@
+import json
+import logging
+import os
+import select
+import socket
+import threading
+import time
+import psycopg2
+
+# Canal de Postgres (LISTEN/NOTIFY) por el que se avisa a todos los workers de la API que cambiaron recomendaciones.
+# Payload: {"sender": ..., "user_ids": [...]} para usuarios puntuales o {"sender": ..., "all": true} para todo.
+# user_ids son siempre ids de la DB, los de Score, Prediction_Score y la cache de la API
+CHANNEL = 'recommendations_changed'
+# NOTIFY acepta payloads de hasta 8000 bytes: las listas de usuarios se parten en varios mensajes
+MAX_USER_IDS_PER_NOTIFY = 500
+
+logger = logging.getLogger(__name__)
+
+
+def sender_id():
+    # Proceso que notifica, para que no reprocese sus propios cambios (el hostname distingue containers)
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def notify_users(cursor, user_ids):
+    """
+    Avisa que cambiaron las recomendaciones de user_ids (ids de la DB). cursor es un cursor DBAPI: la notificacion se entrega al
+    commitear su transaccion, junto con el cambio (y no se entrega si hay rollback)
+    """
+    user_ids = sorted({int(user_id) for user_id in user_ids})
+    for start in range(0, len(user_ids), MAX_USER_IDS_PER_NOTIFY):
+        payload = {"sender": sender_id(), "user_ids": user_ids[start:start + MAX_USER_IDS_PER_NOTIFY]}
+        cursor.execute("SELECT pg_notify(%s, %s)", (CHANNEL, json.dumps(payload)))
+
+
+def notify_all(cursor):
+    """
+    Avisa que cambiaron todas las recomendaciones (p.ej. nueva version de Prediction_Score)
+    """
+    cursor.execute("SELECT pg_notify(%s, %s)", (CHANNEL, json.dumps({"sender": sender_id(), "all": True})))
+
+
+class RecommendationsListener:
+    """
+    Thread que escucha CHANNEL con una conexion propia (fuera del pool) y, por cada notificacion de otro proceso,
+    llama a on_users(user_ids) o a on_all(). Si la conexion se cae se reconecta y llama a on_all, porque pudo
+    haberse perdido alguna notificacion mientras tanto
+    """
+
+    def __init__(self, dsn, on_users, on_all, poll_seconds=5, retry_seconds=5):
+        self.dsn = dsn
+        self.on_users = on_users
+        self.on_all = on_all
+        self.poll_seconds = poll_seconds
+        self.retry_seconds = retry_seconds
+        self.received = 0
+        self.reconnections = 0
+
+    def start(self):
+        threading.Thread(target=self._run, name='recommendations-listener', daemon=True).start()
+
+    def _listen(self):
+        connection = psycopg2.connect(self.dsn)
+        connection.set_session(autocommit=True)
+        connection.cursor().execute(f"LISTEN {CHANNEL}")
+        return connection
+
+    def _dispatch(self, payload):
+        message = json.loads(payload)
+        if message.get("sender") == sender_id():
+            return
+        self.received += 1
+        if message.get("all"):
+            self.on_all()
+        else:
+            self.on_users(message.get("user_ids", []))
+
+    def _run(self):
+        connection = None
+        connected_before = False
+        while True:
+            try:
+                if connection is None:
+                    connection = self._listen()
+                    if connected_before:
+                        self.reconnections += 1
+                        self.on_all()
+                    connected_before = True
+                if select.select([connection], [], [], self.poll_seconds) == ([], [], []):
+                    continue
+                connection.poll()
+                while connection.notifies:
+                    notify = connection.notifies.pop(0)
+                    try:
+                        self._dispatch(notify.payload)
+                    except Exception as e:
+                        logger.warning(f"No se pudo aplicar la notificacion {notify.payload!r}: {e}")
+            except Exception as e:
+                logger.warning(f"Conexion LISTEN {CHANNEL} perdida, se reintenta en {self.retry_seconds}s: {e}")
+                if connection is not None:
+                    try:
+                        connection.close()
+                    except Exception:
+                        pass
+                connection = None
+                time.sleep(self.retry_seconds)
+
+    def stats(self):
+        return {"received": self.received, "reconnections": self.reconnections}
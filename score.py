@@ -5,9 +5,10 @@ from pelicula import Pelicula
 from usuario import Usuario
 from persona import Persona
 from trabajador import Trabajador
-from sqlalchemy import Column, Integer, DateTime, Enum
+from dirty_user import DirtyUser
+from sqlalchemy import Column, Integer, DateTime, Enum, Index
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import desc
+from sqlalchemy import desc, any_, select
 
 Base = declarative_base()
 
@@ -20,6 +21,11 @@ class Score(Base):
     pelicula_id = Column(Integer, nullable=False)
     puntuacion = Column(Integer, nullable=False)
     timestamp = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        # Soporta el anti-join de peliculas ya vistas en las recomendaciones
+        Index('ix_score_user_id_pelicula_id', 'user_id', 'pelicula_id'),
+    )
     
     def __init__(self, user_id, pelicula_id, puntuacion, timestamp, id=None):
         self.user_id = user_id
@@ -40,11 +46,37 @@ class Score(Base):
 
         return new_df
 
+    @classmethod
+    def get_by_user_id_statement(cls, user_id):
+        return select(Score.pelicula_id).where(Score.user_id == int(user_id))
+
     @classmethod
     def get_by_user_id(cls, session, user_id):
-        rankings = session.query(Score.pelicula_id).filter(Score.user_id == user_id).all()
-        rows = [row.pelicula_id for row in rankings]
-        return rows
+        rows = session.execute(cls.get_by_user_id_statement(user_id)).scalars().all()
+        return list(rows)
+
+    @classmethod
+    def get_ratings_by_user_id(cls, session, user_id):
+        """
+        Devuelve la lista de tuplas (pelicula_id, puntuacion) de los scores del usuario
+        """
+        rankings = session.query(Score.pelicula_id, Score.puntuacion).filter(Score.user_id == user_id).all()
+        return [(row.pelicula_id, row.puntuacion) for row in rankings]
+
+    @classmethod
+    def get_ratings_by_user_ids(cls, session, user_ids):
+        """
+        Version de get_ratings_by_user_id para muchos usuarios en una sola query.
+        Devuelve un dict user_id -> lista de tuplas (pelicula_id, puntuacion); los usuarios sin scores no aparecen
+        """
+        rankings = (session
+                    .query(Score.user_id, Score.pelicula_id, Score.puntuacion)
+                    .filter(Score.user_id == any_([int(user_id) for user_id in user_ids]))
+                    .all())
+        ratings_by_user = {}
+        for row in rankings:
+            ratings_by_user.setdefault(row.user_id, []).append((row.pelicula_id, row.puntuacion))
+        return ratings_by_user
 
 
     def class_instance_to_df_row(self):
@@ -54,21 +86,26 @@ class Score(Base):
         score_as_dict = {'id': self.id, 'user_id': self.user_id, 'movie_id': self.pelicula_id, 'rating': self.puntuacion, 'Date': self.timestamp}
         return pd.DataFrame([score_as_dict])
     
-    def write_df(self, df_scores, overwrite = False):
+    def write_df(self, df_scores, overwrite = False, session = None):
         """
         Este método recibe el dataframe de scores y agrega el score
         # Si ya existía un score del user para la pelicula, y overwrite=True, actualiza el score y timestamp
         # Si no existía, lo agrega, con el id máximo + 1
+        # Si se pasa session, marca al user en Dirty_User para recalcular sus predicciones (no commitea)
         """
         ranking_para_user_y_movie = df_scores.query(f'user_id == {str(self.user_id)} and movie_id == {str(self.pelicula_id)}')
         if ranking_para_user_y_movie.empty:
             self.id = df_scores["id"].max() + 1
             print(f"No existe el ranking para ese user y movie, se agregara con id maximo: {self.id}")
             df_scores = pd.concat([df_scores, self.class_instance_to_df_row()], ignore_index=True)
+            if session:
+                DirtyUser.mark(session, [self.user_id])
         elif overwrite:
             print("Ya existia el ranking para user y movie, se actualizará puntuación y timestamp (se seteó overwrite en True)")
             self.id = ranking_para_user_y_movie.iloc[0]['id']
             df_scores.loc[df_scores['id'] == self.id] = self.class_instance_to_df_row().values.tolist()[0]
+            if session:
+                DirtyUser.mark(session, [self.user_id])
         else: 
             print("Error: Ya existia el ranking para user y movie (se seteó overwrite en False)")
         return df_scores
@@ -112,10 +149,11 @@ class Score(Base):
 
         return df_scores
 
-    def remove_from_df(self, df_scores):
+    def remove_from_df(self, df_scores, session = None):
         """
         Borra del DataFrame el objeto contenido en esta clase.
-        Para realizar el borrado sólo deben coincidir el user_id y el pelicula_id
+        Para realizar el borrado sólo deben coincidir el user_id y el pelicula_id.
+        Si se pasa session, marca al user en Dirty_User para recalcular sus predicciones (no commitea)
         """
 
         row_existente = Score.get_from_df(df_scores, users_ids=[self.user_id], peliculas_ids=[self.pelicula_id])
@@ -124,6 +162,8 @@ class Score(Base):
         else: 
             print(f"Score encontrado para user_id = {self.user_id} y movie_id = {self.pelicula_id}, con id {row_existente.iloc[0]['id']}, puntuacion {row_existente.iloc[0]['rating']} y timestamp {row_existente.iloc[0]['Date']}. Se borrará")
             df_scores = df_scores[df_scores['id'] != row_existente.iloc[0]['id']]
+            if session:
+                DirtyUser.mark(session, [self.user_id])
         return df_scores
 
     @classmethod
@@ -0,0 +1,47 @@
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy import Column, Integer, Float, PrimaryKeyConstraint, select
+from pelicula import Pelicula
+
+Base = declarative_base()
+
+
+class SimilarMovie(Base):
+    """
+    Top-N de vecinos precalculados por pelicula (ver db_similar_movies_persistance.py)
+    """
+    __tablename__ = 'Similar_Movie'
+
+    movie_id = Column(Integer, nullable=False)
+    neighbour_id = Column(Integer, nullable=False)
+    rank = Column(Integer, nullable=False)
+    score = Column(Float, nullable=False)
+
+    __table_args__ = (
+        # La PK (movie_id, rank) resuelve el top-k de una pelicula con un range scan
+        PrimaryKeyConstraint('movie_id', 'rank'),
+    )
+
+    def __init__(self, movie_id, neighbour_id, rank, score):
+        self.movie_id = movie_id
+        self.neighbour_id = neighbour_id
+        self.rank = rank
+        self.score = score
+
+    @classmethod
+    def get_by_movie_id_statement(cls, movie_id, k):
+        return (select(SimilarMovie.rank, Pelicula)
+                .join(Pelicula, Pelicula.id == SimilarMovie.neighbour_id)
+                .where(SimilarMovie.movie_id == int(movie_id))
+                .where(SimilarMovie.rank <= int(k))
+                .order_by(SimilarMovie.rank))
+
+    @classmethod
+    def create_dicts_from_rows(cls, rows):
+        return [dict(Pelicula.create_dict_from_row(row.Pelicula), ranking=row.rank) for row in rows]
+
+    @classmethod
+    def get_by_movie_id(cls, session, movie_id, k):
+        """
+        Devuelve las k peliculas mas similares a movie_id ya cruzadas con Pelicula, con su ranking
+        """
+        return cls.create_dicts_from_rows(session.execute(cls.get_by_movie_id_statement(movie_id, k)).all())
@@ -0,0 +1,127 @@
+import joblib
+import numpy as np
+from opensearch_api import (get_movie_vector, get_k_similar_movies, get_all_movie_vectors,
+                            async_get_movie_vector, async_get_k_similar_movies, async_get_all_movie_vectors)
+from ttl_lru_cache import TTLLRUCache
+
+
+def similar_movies_from_hits(hits, movie_id, k):
+    """
+    Transforma los hits del kNN a tuplas (movie_id, score), sin la propia pelicula consultada
+    """
+    similar_movies = [(int(hit["_source"]["movie_id"]), hit["_score"]) for hit in hits
+                      if not int(hit["_source"]["movie_id"]) == int(movie_id)]
+    return similar_movies[:k]
+
+
+class OpenSearchSimilarityBackend:
+    """
+    Peliculas similares via kNN en OpenSearch (indice movie).
+    Los vectores de las peliculas consultadas se cachean (movie_id -> vector) para ahorrar la primera
+    query a OpenSearch en las peliculas mas pedidas
+    """
+
+    def __init__(self, client, vector_cache_size=2000, vector_cache_ttl_seconds=3600):
+        self.client = client
+        self.vector_cache = TTLLRUCache(max_size=vector_cache_size, ttl_seconds=vector_cache_ttl_seconds)
+
+    def preload_vectors(self):
+        """
+        Carga en la cache los vectores de todo el indice (hasta el tamaño maximo de la cache)
+        """
+        for movie_id, vector in get_all_movie_vectors(self.client).items():
+            self.vector_cache.put(int(movie_id), vector)
+
+    def get_movie_vector(self, movie_id):
+        movie_vector = self.vector_cache.get(int(movie_id))
+        if movie_vector is None:
+            movie_vector = get_movie_vector(self.client, movie_id)
+            if movie_vector:
+                self.vector_cache.put(int(movie_id), movie_vector)
+        return movie_vector
+
+    def get_similar_movies(self, movie_id, k):
+        """
+        Devuelve hasta k tuplas (movie_id, score) de las peliculas mas similares a movie_id, sin incluirla,
+        o None si la pelicula no existe en el indice
+        """
+        movie_vector = self.get_movie_vector(movie_id)
+        if not movie_vector:
+            return None
+        # Pido una mas porque la propia pelicula vuelve como su vecina mas cercana
+        hits = get_k_similar_movies(self.client, movie_vector, k + 1)
+        return similar_movies_from_hits(hits, movie_id, k)
+
+
+class AsyncOpenSearchSimilarityBackend(OpenSearchSimilarityBackend):
+    """
+    Version de OpenSearchSimilarityBackend para AsyncOpenSearch (recommendations_api_async.py), con la misma cache
+    de vectores. Los metodos son corrutinas
+    """
+
+    async def preload_vectors(self):
+        for movie_id, vector in (await async_get_all_movie_vectors(self.client)).items():
+            self.vector_cache.put(int(movie_id), vector)
+
+    async def get_movie_vector(self, movie_id):
+        movie_vector = self.vector_cache.get(int(movie_id))
+        if movie_vector is None:
+            movie_vector = await async_get_movie_vector(self.client, movie_id)
+            if movie_vector:
+                self.vector_cache.put(int(movie_id), movie_vector)
+        return movie_vector
+
+    async def get_similar_movies(self, movie_id, k):
+        movie_vector = await self.get_movie_vector(movie_id)
+        if not movie_vector:
+            return None
+        hits = await async_get_k_similar_movies(self.client, movie_vector, k + 1)
+        return similar_movies_from_hits(hits, movie_id, k)
+
+
+class LocalSimilarityBackend:
+    """
+    Peliculas similares por coseno sobre la matriz embedding_movies_genre, sin OpenSearch.
+    La matriz se abre memory-mapped y la fila i corresponde a la fila i de peliculas_df (mismo mapeo que
+    db_vectorial_embeddings_saving.py). Por default el top-k es exacto con NumPy; con approximate=True
+    usa un indice HNSW en memoria si hnswlib está instalado
+    """
+
+    def __init__(self, embeddings_file='embedding_movies_genre', movies_file='peliculas_df', approximate=False):
+        self.embeddings = joblib.load(embeddings_file, mmap_mode='r')
+        self.norms = np.linalg.norm(self.embeddings, axis=1)
+        self.movie_ids = joblib.load(movies_file)['movie_id'].values.astype(np.int64)
+        self.index_by_movie_id = {int(movie_id): i for i, movie_id in enumerate(self.movie_ids)}
+        self.approximate_index = self.build_approximate_index() if approximate else None
+
+    def build_approximate_index(self):
+        try:
+            import hnswlib
+        except ImportError:
+            print("hnswlib no está instalado, se usa el top-k exacto")
+            return None
+        index = hnswlib.Index(space='cosine', dim=self.embeddings.shape[1])
+        index.init_index(max_elements=len(self.movie_ids), ef_construction=200, M=16)
+        index.add_items(np.asarray(self.embeddings, dtype=np.float32), np.arange(len(self.movie_ids)))
+        index.set_ef(100)
+        return index
+
+    def get_similar_movies(self, movie_id, k):
+        """
+        Devuelve hasta k tuplas (movie_id, score) de las peliculas mas similares a movie_id, sin incluirla,
+        o None si la pelicula no existe
+        """
+        i = self.index_by_movie_id.get(int(movie_id))
+        if i is None:
+            return None
+        n = min(k + 1, len(self.movie_ids))
+        if self.approximate_index is not None:
+            labels, distances = self.approximate_index.knn_query(np.asarray(self.embeddings[i], dtype=np.float32), k=n)
+            neighbours, scores = labels[0], 1 - distances[0]
+        else:
+            scores = (self.embeddings @ self.embeddings[i]) / (self.norms * self.norms[i])
+            neighbours = np.argpartition(-scores, n - 1)[:n]
+            neighbours = neighbours[np.argsort(-scores[neighbours], kind='stable')]
+            scores = scores[neighbours]
+        similar_movies = [(int(self.movie_ids[j]), float(score)) for j, score in zip(neighbours, scores) if j != i]
+        return similar_movies[:k]
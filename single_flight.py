@@ -0,0 +1,67 @@
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Colapsa llamadas concurrentes con la misma key: la primera ejecuta fn y las que llegan mientras está en
+    vuelo esperan y reciben el mismo resultado (o la misma excepción). No cachea: terminada la llamada, la
+    siguiente con esa key vuelve a ejecutar fn, así que nunca se sirve data vieja.
+    Es thread-safe para poder compartirse entre los threads de la API. Lleva contadores de llamadas,
+    ejecuciones y requests colapsadas.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.executions = 0
+        self.collapsed = 0
+
+    def do(self, key, fn):
+        """
+        Devuelve fn(), compartiendo la ejecución con las llamadas concurrentes con la misma key.
+        El resultado es el mismo objeto para todas: los callers no deben modificarlo
+        """
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.executions += 1
+            else:
+                self.collapsed += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "executions": self.executions,
+                "collapsed": self.collapsed,
+                "collapsed_ratio": self.collapsed / self.calls if self.calls else 0.0,
+                "in_flight": len(self._calls)
+            }
@@ -3,7 +3,7 @@ drop table if exists "Pelicula";
 drop table if exists "Usuario";
 drop table if exists "Trabajador";
 drop table if exists "Persona";
-drop table if exists "Prediction_Score";
+drop view if exists "Prediction_Score";
 
 select * from "Persona";
 select * from "Usuario";
@@ -12,4 +12,16 @@ select * from "Score";
 select * from "Pelicula";
 select * from "Prediction_Score";
 
-select * from "Score" where user_id=1 order by pelicula_id ASC;
\ No newline at end of file
+select * from "Score" where user_id=1 order by pelicula_id ASC;
+
+-- Indice del anti-join de recomendaciones contra Score (create_all solo lo crea en tablas nuevas)
+create index if not exists ix_score_user_id_pelicula_id on "Score" (user_id, pelicula_id);
+-- Prediction_Score es una vista: el indice del top-k lo tiene cada version (y cada particion), ver create_version_indexes
+select tablename, indexname from pg_indexes where tablename like 'Prediction\_Score\_v%' order by tablename, indexname;
+
+-- Usuarios pendientes de recalcular predicciones (los triggers de Score se crean en db_tables_creation.py)
+select * from "Dirty_User" order by changed_at;
+
+-- Version activa de Prediction_Score (vista) y versiones cargadas
+select table_name from information_schema.view_table_usage where view_name = 'Prediction_Score';
+select tablename from pg_tables where tablename like 'Prediction\_Score\_v%' order by tablename;
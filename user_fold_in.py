@@ -0,0 +1,151 @@
+import argparse
+import time
+import joblib
+import numpy as np
+import pandas as pd
+from sqlalchemy.orm import sessionmaker
+from pelicula import Pelicula
+from score import Score
+from numpy_rating_model import NumpyRatingModel, OUTPUT_SCALE, sigmoid
+from notebook_ids import NotebookIds
+
+
+class UserFoldIn:
+    """
+    Fold-in de un usuario sobre el modelo ya entrenado: deja fijos los embeddings de peliculas y los pesos de la red y
+    optimiza solo el vector embuser del usuario contra sus ratings en Score (error cuadratico + regularizacion L2 hacia
+    el vector inicial), con pasos de Adam vectorizados sobre todas sus peliculas rankeadas.
+    Despues predice todas sus peliculas no vistas con el vector resultante.
+    solve y predict_unseen trabajan con ids de la notebook; predict_user y refresh_user reciben y devuelven ids de la
+    DB, los de Score y Prediction_Score, y los traducen con notebook_ids (dict_users / dict_pelis)
+    """
+
+    def __init__(self, model, movie_ids, genres, notebook_ids, steps=100, learning_rate=0.05, l2=0.01):
+        self.model = model
+        self.movie_ids = movie_ids
+        self.genres = genres
+        self.notebook_ids = notebook_ids
+        self.steps = steps
+        self.learning_rate = learning_rate
+        self.l2 = l2
+        self.position_by_movie_id = np.full(movie_ids.max() + 1, -1, dtype=np.int64)
+        self.position_by_movie_id[movie_ids] = np.arange(len(movie_ids))
+        # La fila 0 de embuser no corresponde a ningun usuario (los ids de la notebook empiezan en 1)
+        self.mean_user_vector = model.embuser[1:].mean(axis=0)
+
+    @classmethod
+    def load(cls, model_file='model_weights.npz', movies_file='peliculas_df', users_map_file='dict_users',
+             movies_map_file='dict_pelis', **kwargs):
+        df_movies = joblib.load(movies_file)
+        return cls(NumpyRatingModel.load(model_file),
+                   df_movies['movie_id'].values.astype(np.int64),
+                   df_movies[Pelicula.generos_de_peliculas].values.astype(np.float32),
+                   NotebookIds.load(users_map_file, movies_map_file), **kwargs)
+
+    def initial_vector(self, user_id):
+        if user_id is not None and 0 < user_id < len(self.model.embuser):
+            return self.model.embuser[user_id].astype(np.float64)
+        return self.mean_user_vector.astype(np.float64)
+
+    def solve(self, user_id, movie_ids, ratings):
+        """
+        Devuelve el vector embuser que mejor explica los ratings del usuario sobre movie_ids.
+        Sin ratings (o con peliculas fuera del catalogo) devuelve el vector inicial
+        """
+        initial = self.initial_vector(user_id)
+        movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        positions = np.full(len(movie_ids), -1, dtype=np.int64)
+        in_range = (movie_ids >= 0) & (movie_ids < len(self.position_by_movie_id))
+        positions[in_range] = self.position_by_movie_id[movie_ids[in_range]]
+        valid = positions >= 0
+        if not valid.any():
+            return initial
+        positions = positions[valid]
+        ratings = np.asarray(ratings, dtype=np.float64)[valid]
+        model = self.model
+        # El aporte de pelicula y generos a la primera capa no depende del usuario: se calcula una sola vez
+        movie_term = (model.movie_projection[self.movie_ids[positions]] + self.genres[positions] @ model.genre_kernel
+                      + model.biases[0]).astype(np.float64)
+
+        user_vector = initial.copy()
+        m, v = np.zeros_like(user_vector), np.zeros_like(user_vector)
+        beta1, beta2, epsilon = 0.9, 0.999, 1e-8
+        for step in range(1, self.steps + 1):
+            # Forward guardando las activaciones de cada capa
+            activations = [sigmoid(user_vector @ model.user_kernel + movie_term)]
+            for kernel, bias in zip(model.kernels[1:], model.biases[1:]):
+                activations.append(sigmoid(activations[-1] @ kernel + bias))
+            ratings_pred = OUTPUT_SCALE * activations[-1][:, 0]
+
+            # Backpropagation de la loss hasta la entrada de la primera capa
+            grad = (2 / len(ratings) * (ratings_pred - ratings) * OUTPUT_SCALE)[:, np.newaxis]
+            grad = grad * activations[-1] * (1 - activations[-1])
+            for kernel, activation in zip(model.kernels[:0:-1], activations[-2::-1]):
+                grad = (grad @ kernel.T) * activation * (1 - activation)
+            gradient = model.user_kernel @ grad.sum(axis=0) + 2 * self.l2 * (user_vector - initial)
+
+            m = beta1 * m + (1 - beta1) * gradient
+            v = beta2 * v + (1 - beta2) * gradient ** 2
+            user_vector -= self.learning_rate * (m / (1 - beta1 ** step)) / (np.sqrt(v / (1 - beta2 ** step)) + epsilon)
+        return user_vector
+
+    def predict_unseen(self, user_id, user_vector, seen_movie_ids):
+        """
+        DataFrame (movie_id, user_id, ratings_pred) con la prediccion de todas las peliculas no vistas del usuario
+        """
+        unseen = ~np.isin(self.movie_ids, np.asarray(seen_movie_ids, dtype=np.int64))
+        ratings_pred = self.model.predict_with_user_vector(user_vector, self.movie_ids[unseen], self.genres[unseen])
+        return pd.DataFrame({'movie_id': self.movie_ids[unseen], 'user_id': int(user_id), 'ratings_pred': ratings_pred})
+
+    def predict_user(self, db_user_id, db_ratings):
+        """
+        Fold-in a partir de los scores del usuario en la DB (tuplas (pelicula_id, puntuacion)). Un usuario que no
+        estaba en el entrenamiento (sin fila en embuser) parte del vector de usuario promedio.
+        Devuelve el DataFrame de predict_unseen con ids de la DB
+        """
+        ratings = self.notebook_ids.ratings(db_ratings)
+        movie_ids = [movie_id for movie_id, _ in ratings]
+        user_vector = self.solve(self.notebook_ids.user_id(db_user_id), movie_ids, [puntuacion for _, puntuacion in ratings])
+        df_predictions = self.predict_unseen(db_user_id, user_vector, movie_ids)
+        df_predictions['movie_id'] = self.notebook_ids.db_movie_ids(df_predictions['movie_id'])
+        return df_predictions
+
+    def refresh_user(self, session, connection, user_id):
+        """
+        Hace el fold-in del usuario (id de la DB) a partir de sus filas de Score y reescribe sus predicciones en
+        Prediction_Score. connection es una conexion DBAPI (engine.raw_connection()).
+        Devuelve (cantidad de ratings, cantidad de predicciones)
+        """
+        from db_predictions_persistance import upsert_predictions
+        ratings = Score.get_ratings_by_user_id(session, user_id)
+        df_predictions = self.predict_user(user_id, ratings)
+        upsert_predictions(connection, [df_predictions])
+        return len(ratings), len(df_predictions)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fold-in de usuarios: recalcula su embedding y sus predicciones sin reentrenar")
+    parser.add_argument('--user-id', type=int, action='append', required=True, help="puede repetirse")
+    parser.add_argument('--model', default='model_weights.npz', help="pesos exportados con numpy_rating_model.py")
+    parser.add_argument('--movies', default='peliculas_df', help="artefacto joblib con movie_id y generos")
+    parser.add_argument('--users-map', default='dict_users', help="artefacto joblib de la notebook: user_id de la DB -> de la notebook")
+    parser.add_argument('--movies-map', default='dict_pelis', help="artefacto joblib de la notebook: movie_id de la DB -> de la notebook")
+    parser.add_argument('--steps', type=int, default=100)
+    parser.add_argument('--learning-rate', type=float, default=0.05)
+    parser.add_argument('--l2', type=float, default=0.01)
+    args = parser.parse_args()
+
+    from db_predictions_persistance import engine
+    fold_in = UserFoldIn.load(args.model, args.movies, args.users_map, args.movies_map, steps=args.steps,
+                              learning_rate=args.learning_rate, l2=args.l2)
+    session = sessionmaker(bind=engine)()
+    connection = engine.raw_connection()
+    try:
+        for user_id in args.user_id:
+            start_time = time.perf_counter()
+            n_ratings, n_predictions = fold_in.refresh_user(session, connection, user_id)
+            print(f"Usuario {user_id}: fold-in sobre {n_ratings} ratings, {n_predictions} predicciones reescritas "
+                  f"en {(time.perf_counter() - start_time) * 1000:.1f}ms")
+    finally:
+        connection.close()
+        session.close()